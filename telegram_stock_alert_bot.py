@@ -6,12 +6,22 @@ Features:
  • Guided /watch and /unwatch flows
  • Price alerts: set, view, remove
  • Paginated subscription list
- • Daily digest at 18:00
+ • Daily digest at 18:00, or each user's own time and timezone
 """
 
-import os, sqlite3, logging, asyncio, requests, html
-from datetime import datetime, date
+import os, sys, sqlite3, logging, asyncio, random, time, html, queue, threading, json, gzip, hashlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, suppress
+import aiohttp
+from yarl import URL
+from datetime import datetime, date, timedelta, timezone, time as dtime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from typing import Optional
+from collections import OrderedDict, deque
+from array import array
+from bisect import bisect_left, bisect_right, insort
+import heapq
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup
 )
@@ -19,7 +29,8 @@ from telegram.ext import (
     ApplicationBuilder, CommandHandler, CallbackQueryHandler,
     ContextTypes, MessageHandler, filters
 )
-from apscheduler.schedulers.background import BackgroundScheduler
+from telegram.error import TelegramError, RetryAfter, Forbidden, TimedOut, NetworkError
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 
 # ─────────────── ENV & DB ─────────────── #
@@ -27,40 +38,1263 @@ from apscheduler.triggers.cron import CronTrigger
 BOT_TOKEN   = os.getenv("TG_TOKEN")
 ALPHA_KEY   = os.getenv("ALPHAVANTAGE_KEY")
 POLL_SEC    = int(os.getenv("POLL_INTERVAL", 15))
-if not BOT_TOKEN:
-    raise RuntimeError("TG_TOKEN env var missing")
-
-DB = sqlite3.connect("watch.db", check_same_thread=False)
-c = DB.cursor()
-c.executescript("""
-CREATE TABLE IF NOT EXISTS watch(user INTEGER, symbol TEXT, UNIQUE(user,symbol));
-CREATE TABLE IF NOT EXISTS alerts(user INTEGER, symbol TEXT, headline TEXT, ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
-CREATE TABLE IF NOT EXISTS price_alerts(user INTEGER, symbol TEXT, op TEXT, threshold REAL);
-""")
-DB.commit()
+ALPHA_BULK  = os.getenv("ALPHAVANTAGE_BULK", "0") == "1"   # premium REALTIME_BULK_QUOTES
+BULK_MAX    = 100
+QUOTE_CONC    = int(os.getenv("QUOTE_CONCURRENCY", 16))
+QUOTE_TIMEOUT = float(os.getenv("QUOTE_TIMEOUT", 5))
+QUOTE_RETRIES = int(os.getenv("QUOTE_RETRIES", 2))
+QUOTE_BACKOFF = 0.25
+QUOTE_TTL     = float(os.getenv("QUOTE_TTL", 30))     # fresh for this long
+QUOTE_SWR     = float(os.getenv("QUOTE_SWR", 60))     # then served stale while refreshing
+QUOTE_CACHE_SIZE = int(os.getenv("QUOTE_CACHE_SIZE", 5000))
+ALPHA_PER_MIN = int(os.getenv("ALPHAVANTAGE_PER_MIN", 5))    # provider quota; 0 = unlimited
+ALPHA_PER_DAY = int(os.getenv("ALPHAVANTAGE_PER_DAY", 25))
+QUOTA_TICK    = int(os.getenv("QUOTA_TICK_SEC", 10))         # how often due symbols are refreshed
+QUOTE_PROVIDERS = os.getenv("QUOTE_PROVIDERS", "alphavantage,yahoo")   # also sqlite:/path/quotes.db
+YAHOO_SUFFIX    = os.getenv("YAHOO_SUFFIX", ".NS")
+HEDGE_SEC       = float(os.getenv("QUOTE_HEDGE_MS", 800)) / 1000
+QUOTE_DEADLINE  = float(os.getenv("QUOTE_DEADLINE", 10))
+NSE_COOKIE_TTL = int(os.getenv("NSE_COOKIE_TTL", 300))
+POLL_MIN      = int(os.getenv("POLL_MIN_SEC", 5))       # fastest filings poll when rows keep coming
+POLL_MAX      = int(os.getenv("POLL_MAX_SEC", 900))     # slowest, overnight / holidays / throttled
+NSE_TZ        = os.getenv("NSE_TZ", "Asia/Kolkata")
+NSE_SESSION   = os.getenv("NSE_SESSION", "09:15-15:30")   # market hours
+NSE_ACTIVE    = os.getenv("NSE_ACTIVE", "07:30-22:00")    # trading-day window filings still land in
+NSE_HOLIDAYS  = os.getenv("NSE_HOLIDAYS", "")   # YYYY-MM-DD,… or a file with one date per line
+BSE_SYMBOLS   = os.getenv("BSE_SYMBOLS", "")    # scrip_code,SYMBOL;… or a csv file of them; enables the BSE feed
+FILING_FEEDS  = os.getenv("FILING_FEEDS", "nse:equities,nse:sme,nse:debt" + (",bse" if BSE_SYMBOLS else ""))
+DEDUP_WINDOW  = 1800    # the same filing on two exchanges lands within this many seconds
+QUOTE_STREAM  = os.getenv("QUOTE_STREAM", "")   # ws(s)://… feed, or replay:ticks.ndjson[@speed]
+STREAM_FLUSH_SEC = 0.25   # ticks are coalesced per symbol for this long before evaluation
+SEND_WORKERS  = int(os.getenv("SEND_WORKERS", 32))
+SEND_RATE     = float(os.getenv("SEND_RATE", 30))    # Telegram global cap, msg/s
+CHAT_RATE     = float(os.getenv("CHAT_RATE", 1))     # per-chat cap, msg/s
+OUTBOX_SEC    = int(os.getenv("OUTBOX_INTERVAL", 5))
+OUTBOX_BATCH  = 500
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_KEEP_DAYS    = 2
+ALERTLOG_BATCH = int(os.getenv("ALERTLOG_BATCH", 1000))
+ALERTLOG_SEC   = float(os.getenv("ALERTLOG_FLUSH_SEC", 2))
+ALERT_KEEP_DAYS = int(os.getenv("ALERT_RETENTION_DAYS", 30))
+ARCHIVE_DIR     = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_CHUNK   = 5000
+DIGEST_CHUNK     = 500
+DIGEST_TZ        = os.getenv("DIGEST_TZ", "Asia/Kolkata")
+DIGEST_AT        = os.getenv("DIGEST_AT", "18:00")
+DIGEST_WINDOW    = int(os.getenv("DIGEST_WINDOW_SEC", 900))   # each cohort is spread over this
+DIGEST_GRACE     = 3600     # a slot missed by up to this much (e.g. restart) still goes out
+DIGEST_MAX_CHARS = 4000     # Telegram caps messages at 4096
+SEEN_KEEP_DAYS = int(os.getenv("SEEN_RETENTION_DAYS", 7))
+SEEN_CACHE     = 20_000
+CATCHUP_CONC   = int(os.getenv("CATCHUP_CONCURRENCY", 3))   # parallel day pages after downtime
+CATCHUP_BATCH  = int(os.getenv("CATCHUP_BATCH", 50))        # filings dispatched per step
+CATCHUP_PAUSE  = float(os.getenv("CATCHUP_PAUSE_SEC", 2))
+DB_MMAP        = int(os.getenv("DB_MMAP_BYTES", 256 * 1024 * 1024))
+DB_READERS     = int(os.getenv("DB_READERS", 4))
+WRITE_BATCH    = 256      # max queued write jobs folded into one commit
+
+DB_PATH = os.getenv("DB_PATH", "watch.db")
+
+def connect(path=DB_PATH, readonly=False) -> sqlite3.Connection:
+    if readonly:
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints; safe with WAL
+    db.execute(f"PRAGMA mmap_size={DB_MMAP}")
+    db.execute("PRAGMA cache_size=-32000")       # 32 MB page cache
+    db.execute("PRAGMA temp_store=MEMORY")
+    return db
+
+# ─────────────── Migrations ─────────────── #
+# Each step runs in its own short BEGIN IMMEDIATE transaction (readers keep
+# going under WAL) and is recorded in schema_version. Steps must be idempotent
+# so a DB created by older inline DDL can be brought forward safely.
+
+MIGRATIONS = []          # (version, name, fn, tables it rewrites or indexes)
+REWRITE_ROWS_PER_SEC = 250_000   # rough copy/index rate used for dry-run estimates
+
+def migration(version: int, name: str, touches=()):
+    def deco(fn):
+        MIGRATIONS.append((version, name, fn, touches))
+        return fn
+    return deco
+
+def _run(db, script: str):
+    for stmt in script.split(";"):
+        if stmt.strip(): db.execute(stmt)
+
+@migration(1, "base tables")
+def _m_base(db):
+    _run(db, """
+    CREATE TABLE IF NOT EXISTS watch(user INTEGER, symbol TEXT, UNIQUE(user,symbol));
+    CREATE TABLE IF NOT EXISTS alerts(user INTEGER, symbol TEXT, headline TEXT, ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+    CREATE TABLE IF NOT EXISTS price_alerts(user INTEGER, symbol TEXT, op TEXT, threshold REAL);
+    CREATE TABLE IF NOT EXISTS outbox(
+        id INTEGER PRIMARY KEY, key TEXT UNIQUE, user INTEGER, text TEXT, parse_mode TEXT,
+        symbol TEXT, headline TEXT, status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0,
+        next_at REAL DEFAULT 0, created TIMESTAMP DEFAULT CURRENT_TIMESTAMP, sent_at TIMESTAMP);
+    CREATE INDEX IF NOT EXISTS outbox_pending ON outbox(status, id);
+    CREATE TABLE IF NOT EXISTS seen_filings(id TEXT PRIMARY KEY, seen_at REAL) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS seen_filings_age ON seen_filings(seen_at);
+    """)
+
+@migration(2, "lookup indexes", touches=("alerts", "price_alerts", "watch"))
+def _m_indexes(db):
+    _run(db, """
+    CREATE INDEX IF NOT EXISTS alerts_user_ts ON alerts(user, ts);
+    CREATE INDEX IF NOT EXISTS price_alerts_symbol ON price_alerts(symbol);
+    CREATE INDEX IF NOT EXISTS price_alerts_user ON price_alerts(user);
+    CREATE INDEX IF NOT EXISTS watch_symbol ON watch(symbol);
+    """)
+
+@migration(3, "price_alerts primary key", touches=("price_alerts",))
+def _m_price_alerts_pk(db):
+    if "id" in [r[1] for r in db.execute("PRAGMA table_info(price_alerts)")]:
+        return
+    # ids keep the old rowids, so anything already referring to a row stays valid
+    _run(db, """
+    CREATE TABLE price_alerts_new(id INTEGER PRIMARY KEY, user INTEGER NOT NULL,
+        symbol TEXT NOT NULL, op TEXT NOT NULL, threshold REAL NOT NULL);
+    INSERT INTO price_alerts_new(id,user,symbol,op,threshold)
+        SELECT rowid,user,symbol,op,threshold FROM price_alerts;
+    DROP TABLE price_alerts;
+    ALTER TABLE price_alerts_new RENAME TO price_alerts;
+    CREATE INDEX price_alerts_symbol ON price_alerts(symbol);
+    CREATE INDEX price_alerts_user ON price_alerts(user);
+    """)
+
+@migration(4, "alerts daily rollup")
+def _m_alerts_daily(db):
+    _run(db, """
+    CREATE TABLE IF NOT EXISTS alerts_daily(user INTEGER, day TEXT, symbol TEXT, n INTEGER,
+        PRIMARY KEY(user, day, symbol)) WITHOUT ROWID;
+    """)
+
+@migration(5, "digest runs", touches=("alerts",))
+def _m_digest(db):
+    _run(db, """
+    CREATE INDEX IF NOT EXISTS alerts_ts ON alerts(ts);
+    CREATE TABLE IF NOT EXISTS digest_runs(day TEXT PRIMARY KEY, last_user INTEGER, done INTEGER DEFAULT 0);
+    """)
+
+@migration(6, "per-user digest preferences")
+def _m_user_prefs(db):
+    # digest progress is now tracked per user by outbox keys; the run cursor goes
+    _run(db, """
+    CREATE TABLE IF NOT EXISTS user_prefs(user INTEGER PRIMARY KEY, tz TEXT, digest_at TEXT);
+    DROP TABLE IF EXISTS digest_runs;
+    """)
+
+@migration(7, "feed poll state")
+def _m_poll_state(db):
+    _run(db, "CREATE TABLE IF NOT EXISTS poll_state(feed TEXT PRIMARY KEY, polled_at REAL);")
+
+@migration(8, "filing filters")
+def _m_filing_filters(db):
+    # symbol '*' applies to every watch; pattern is a keyword or a #category
+    _run(db, "CREATE TABLE IF NOT EXISTS filing_filters(user INTEGER, symbol TEXT, pattern TEXT, "
+             "UNIQUE(user,symbol,pattern));")
+
+def _rows(db, table: str) -> int:
+    if not db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone():
+        return 0
+    return db.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+def migrate(db, dry_run=False) -> list[int]:
+    """Apply pending migrations in order; returns the versions applied (or planned)."""
+    if not dry_run:
+        db.execute("CREATE TABLE IF NOT EXISTS schema_version("
+                   "version INTEGER PRIMARY KEY, name TEXT, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    done = {v for (v,) in db.execute("SELECT version FROM schema_version")} if _rows(db, "schema_version") else set()
+    # DBs versioned with PRAGMA user_version before schema_version existed
+    legacy = db.execute("PRAGMA user_version").fetchone()[0]
+    if legacy and not done:
+        done = {v for v, _, _, _ in MIGRATIONS if v <= legacy}
+        if not dry_run:
+            db.executemany("INSERT INTO schema_version(version,name) VALUES(?,?)",
+                           [(v, n) for v, n, _, _ in MIGRATIONS if v in done])
+            db.commit()
+    applied = []
+    for v, name, fn, touches in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if v in done: continue
+        if dry_run:
+            rows = sum(_rows(db, t) for t in touches)
+            log.info("migration %d (%s): would touch %d rows in %s, est. %.1fs",
+                     v, name, rows, ",".join(touches) or "-", rows / REWRITE_ROWS_PER_SEC)
+            applied.append(v)
+            continue
+        t0 = time.monotonic()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            fn(db)
+            db.execute("INSERT INTO schema_version(version,name) VALUES(?,?)", (v, name))
+            db.commit()
+        except Exception:
+            db.rollback()
+            log.exception("migration %d (%s) failed; rolled back", v, name)
+            raise
+        log.info("migration %d (%s) applied in %.2fs", v, name, time.monotonic() - t0)
+        applied.append(v)
+    if applied and not dry_run:
+        db.execute("ANALYZE")
+    return applied
+
+def local_day_range(tz: ZoneInfo, d: date) -> tuple[str, str]:
+    """[start, end) bounds on alerts.ts (UTC) for a calendar day in `tz`, so the (user, ts) index applies."""
+    start, end = (datetime.combine(x, dtime.min, tz).astimezone(timezone.utc)
+                  for x in (d, d + timedelta(days=1)))
+    return start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)-7s | %(message)s")
 log = logging.getLogger("bot")
 
+# ─────────────── Store ─────────────── #
+
+class Store:
+    """Async access to watch.db: reads on a pool of read-only connections, all
+    writes through one writer thread that folds queued jobs into one commit."""
+
+    def __init__(self, path=DB_PATH, readers=DB_READERS):
+        self.path    = path
+        self.readers = readers
+        self._local  = threading.local()
+        self._rconns: list[sqlite3.Connection] = []
+        self._rpool: Optional[ThreadPoolExecutor] = None
+        self._wq: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self.commits = self.jobs = 0
+
+    def open(self):
+        self._rpool  = ThreadPoolExecutor(self.readers, thread_name_prefix="db-read")
+        self._writer = threading.Thread(target=self._write_loop, name="db-write", daemon=True)
+        self._writer.start()
+
+    async def close(self):
+        if not self._writer: return
+        self._wq.put(None)
+        await asyncio.to_thread(self._writer.join)
+        self._rpool.shutdown(wait=True)
+        for conn in self._rconns: conn.close()
+        self._writer = None
+
+    # reads
+
+    def _read(self, sql, params):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path, readonly=True)
+            self._rconns.append(conn)
+        return conn.execute(sql, params).fetchall()
+
+    async def read(self, sql: str, params=()) -> list:
+        return await asyncio.get_running_loop().run_in_executor(self._rpool, self._read, sql, params)
+
+    # writes
+
+    async def tx(self, fn):
+        """Run fn(conn) on the writer thread inside a group transaction; returns its result.
+        A job that raises is rolled back alone (savepoint); the rest of the group commits."""
+        loop = asyncio.get_running_loop()
+        fut  = loop.create_future()
+        self._wq.put((fn, loop, fut))
+        return await fut
+
+    async def write(self, sql: str, params=()) -> int:
+        return await self.tx(lambda db: db.execute(sql, params).rowcount)
+
+    async def write_many(self, sql: str, seq) -> int:
+        seq = list(seq)
+        return await self.tx(lambda db: db.executemany(sql, seq).rowcount)
+
+    def _write_loop(self):
+        db = connect(self.path)
+        db.isolation_level = None     # explicit BEGIN/SAVEPOINT below
+        stop = False
+        while not stop:
+            batch = [self._wq.get()]
+            while len(batch) < WRITE_BATCH:
+                try: batch.append(self._wq.get_nowait())
+                except queue.Empty: break
+            if None in batch:
+                stop = True
+                batch = [j for j in batch if j is not None]
+            if not batch: continue
+            done = []
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                for fn, loop, fut in batch:
+                    db.execute("SAVEPOINT job")
+                    try:
+                        res = fn(db)
+                        db.execute("RELEASE job")
+                        done.append((loop, fut, res, None))
+                    except Exception as e:
+                        db.execute("ROLLBACK TO job"); db.execute("RELEASE job")
+                        done.append((loop, fut, None, e))
+                db.execute("COMMIT")
+                self.commits += 1
+                self.jobs    += len(batch)
+            except Exception as e:
+                log.exception("group commit of %d writes failed", len(batch))
+                if db.in_transaction: db.execute("ROLLBACK")
+                done = [(loop, fut, None, e) for _, loop, fut in batch]
+            for loop, fut, res, err in done:
+                loop.call_soon_threadsafe(_settle, fut, res, err)
+        db.close()
+
+def _settle(fut, res, err):
+    if fut.cancelled(): return
+    if err is not None: fut.set_exception(err)
+    else: fut.set_result(res)
+
+STORE = Store()
+
 # ──────────── Utility Functions ──────────── #
 
-def fetch_price(sym: str) -> Optional[float]:
-    if not ALPHA_KEY: return None
-    url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={sym}&apikey={ALPHA_KEY}"
-    j = requests.get(url, timeout=5).json()
-    try: return float(j["Global Quote"]["05. price"])
-    except: return None
-
-async def fetch_nse_announcements():
-    import aiohttp
-    url = "https://www.nseindia.com/api/corporate-announcements?index=equities"
-    hdr = {"user-agent":"Mozilla/5.0","referer":"https://www.nseindia.com"}
-    async with aiohttp.ClientSession() as sess:
-        async with sess.get(url, headers=hdr, timeout=10) as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                return data.get("data", [])
-    return []
+AV_URL = "https://www.alphavantage.co/query"
+
+class QuoteClient:
+    """Quote HTTP over one keep-alive session, bounded and retried; Alpha Vantage helpers."""
+
+    def __init__(self, concurrency=QUOTE_CONC, timeout=QUOTE_TIMEOUT, retries=QUOTE_RETRIES):
+        self.concurrency = concurrency
+        self.timeout     = aiohttp.ClientTimeout(total=timeout)
+        self.retries     = retries
+        self._sem        = asyncio.Semaphore(concurrency)
+        self._sess: Optional[aiohttp.ClientSession] = None
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self._sess is None or self._sess.closed:
+            conn = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+            self._sess = aiohttp.ClientSession(connector=conn, timeout=self.timeout)
+        return self._sess
+
+    async def get_json(self, url: str, params: dict) -> Optional[dict]:
+        err = None
+        for attempt in range(self.retries + 1):
+            if attempt:   # full jitter: 0..base*2^n
+                await asyncio.sleep(random.uniform(0, QUOTE_BACKOFF * 2 ** attempt))
+            try:
+                async with self._sem:
+                    async with self._session().get(url, params=params) as resp:
+                        if resp.status == 200:
+                            return await resp.json(content_type=None)
+                        err = f"HTTP {resp.status}"
+                        if resp.status < 500 and resp.status != 429:
+                            break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                err = repr(e)
+        log.warning("quote request %s %s failed: %s", url, params.get("symbol"), err)
+        return None
+
+    async def _get(self, params: dict) -> Optional[dict]:
+        return await self.get_json(AV_URL, {**params, "apikey": ALPHA_KEY})
+
+    async def price(self, sym: str) -> Optional[float]:
+        if not ALPHA_KEY: return None
+        j = await self._get({"function": "GLOBAL_QUOTE", "symbol": sym})
+        try: return float(j["Global Quote"]["05. price"])
+        except: return None
+
+    async def _bulk(self, chunk) -> dict[str, float]:
+        j = await self._get({"function": "REALTIME_BULK_QUOTES", "symbol": ",".join(chunk)})
+        out = {}
+        for q in (j or {}).get("data", []):
+            try: out[q["symbol"].upper()] = float(q["close"])
+            except (KeyError, TypeError, ValueError): continue
+        return out
+
+    async def prices(self, syms) -> dict[str, float]:
+        """One quote per distinct symbol; bulk endpoint when the key allows it."""
+        syms = sorted(set(syms))
+        prices = {}
+        if ALPHA_KEY and ALPHA_BULK:
+            chunks = [syms[i:i+BULK_MAX] for i in range(0, len(syms), BULK_MAX)]
+            for part in await asyncio.gather(*(self._bulk(c) for c in chunks)):
+                prices.update(part)
+        rest = [s for s in syms if s not in prices]
+        for sym, price in zip(rest, await asyncio.gather(*(self.price(s) for s in rest))):
+            if price is not None: prices[sym] = price
+        return prices
+
+    async def close(self):
+        if self._sess and not self._sess.closed:
+            await self._sess.close()
+
+QUOTES = QuoteClient()
+
+class QuoteCache:
+    """Latest price per symbol, shared by every price consumer. Entries are fresh for
+    `ttl`, then served stale for `swr` more seconds while one background refresh
+    runs; concurrent misses on a symbol share a single in-flight fetch. LRU-bounded."""
+
+    def __init__(self, fetch_many, ttl=QUOTE_TTL, swr=QUOTE_SWR, size=QUOTE_CACHE_SIZE):
+        self.fetch_many = fetch_many
+        self.ttl, self.swr, self.size = ttl, swr, size
+        self._data: OrderedDict[str, tuple[float, float]] = OrderedDict()   # sym -> (price, at)
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._tasks: set[asyncio.Task] = set()   # running refreshes, held so they are not collected
+        self.stats = {"hits": 0, "stale": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    def put(self, sym: str, price: float, at: Optional[float] = None):
+        self._data[sym] = (price, time.monotonic() if at is None else at)
+        self._data.move_to_end(sym)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def peek(self, sym: str) -> Optional[float]:
+        e = self._data.get(sym)
+        return e[0] if e else None
+
+    async def _fetch(self, syms: list[str]):
+        prices = {}
+        try:
+            prices = await self.fetch_many(syms)
+        except Exception:
+            log.exception("quote refresh of %d symbols failed", len(syms))
+        finally:   # even if cancelled, waiters are released and the next get_many refetches
+            for sym in syms:
+                if sym in prices: self.put(sym, prices[sym])
+                fut = self._inflight.pop(sym, None)
+                if fut and not fut.done(): fut.set_result(prices.get(sym))
+
+    async def get_many(self, syms, fresh=False) -> dict[str, float]:
+        """fresh=True waits for a refresh instead of serving a stale entry."""
+        now, st = time.monotonic(), self.stats
+        out, wait, fetch = {}, {}, []
+        for sym in set(syms):
+            e = self._data.get(sym)
+            age = now - e[1] if e else None
+            if e and age <= self.ttl:
+                st["hits"] += 1
+                out[sym] = e[0]
+                self._data.move_to_end(sym)
+                continue
+            if e and age <= self.ttl + self.swr and not fresh:
+                st["stale"] += 1
+                out[sym] = e[0]
+            else:
+                st["misses"] += 1
+                if sym in self._inflight: st["coalesced"] += 1
+                wait[sym] = None
+            if sym not in self._inflight:
+                self._inflight[sym] = asyncio.get_running_loop().create_future()
+                fetch.append(sym)
+            if sym in wait: wait[sym] = self._inflight[sym]
+        if fetch:
+            task = asyncio.get_running_loop().create_task(self._fetch(fetch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        for sym, fut in wait.items():
+            price = await asyncio.shield(fut)
+            if price is not None: out[sym] = price
+        return out
+
+    def summary(self) -> str:
+        st = self.stats
+        looked = st["hits"] + st["stale"] + st["misses"]
+        return (f"{len(self._data)} symbols, hit {st['hits']}/{looked} stale {st['stale']} "
+                f"miss {st['misses']} coalesced {st['coalesced']} evicted {st['evictions']}")
+
+class QuotaScheduler:
+    """Spends the Alpha Vantage call budget where it buys the most alert freshness.
+    Each symbol gets a share of the affordable call rate proportional to
+    sqrt(alerts on it) / distance from its last price to the nearest threshold,
+    and is refreshed when its resulting interval has elapsed, most overdue first."""
+
+    def __init__(self, per_min=ALPHA_PER_MIN, per_day=ALPHA_PER_DAY):
+        self.per_min, self.per_day = per_min, per_day
+        self._minute: deque[float] = deque()    # call timestamps in the last 60s
+        self._day, self._day_calls = date.today(), 0
+        self._last: dict[str, float] = {}        # symbol -> last refresh
+        self.interval: dict[str, float] = {}
+
+    def calls_for(self, n: int) -> int:
+        return -(-n // BULK_MAX) if ALPHA_BULK else n
+
+    def spent(self, calls: int):
+        now = time.time()
+        self._roll(now)
+        self._minute.extend([now] * calls)
+        self._day_calls += calls
+
+    def _roll(self, now: float):
+        while self._minute and now - self._minute[0] >= 60:
+            self._minute.popleft()
+        if date.today() != self._day:
+            self._day, self._day_calls = date.today(), 0
+
+    def rate(self, now: float) -> float:
+        """Affordable calls/s: the per-minute cap, or what is left of today spread evenly."""
+        r = self.per_min / 60 if self.per_min else float("inf")
+        if self.per_day:
+            left = datetime.combine(self._day + timedelta(days=1), dtime.min).timestamp() - now
+            r = min(r, max(0, self.per_day - self._day_calls) / max(left, 60))
+        return r
+
+    def capacity(self) -> int:
+        """Symbols that can be fetched right now without breaking either cap."""
+        calls = float("inf")
+        if self.per_min: calls = self.per_min - len(self._minute)
+        if self.per_day: calls = min(calls, self.per_day - self._day_calls)
+        if calls == float("inf"): return 1 << 30
+        return max(0, int(calls)) * (BULK_MAX if ALPHA_BULK else 1)
+
+    def weight(self, sym: str) -> float:
+        n, gap = BOOK.density(sym, QUOTE_CACHE.peek(sym))
+        return (n ** 0.5) / max(gap, 1e-3)
+
+    def pick(self, syms) -> list[str]:
+        now = time.time()
+        self._roll(now)
+        rate = self.rate(now) * (BULK_MAX if ALPHA_BULK else 1)   # symbol refreshes/s
+        weights = {s: self.weight(s) for s in syms}
+        total = sum(weights.values())
+        due = []
+        for sym, w in weights.items():
+            iv = max(QUOTE_TTL, total / (rate * w)) if rate > 0 else float("inf")
+            self.interval[sym] = iv
+            late = now - self._last.get(sym, 0) - iv
+            if late >= 0: due.append((late / iv, sym))
+        due.sort(reverse=True)
+        return [sym for _, sym in due[:self.capacity()]]
+
+    def fetched(self, syms):
+        now = time.time()
+        for s in syms: self._last[s] = now
+
+QUOTA = QuotaScheduler()
+
+# Quote providers: every backend implements prices(); QuoteSource runs them
+# behind per-provider circuit breakers, ordered by health, hedging a slow
+# primary with the next provider.
+
+class QuoteProvider(ABC):
+    """A price backend. prices() returns what it found and raises on outright failure."""
+    name = "base"
+
+    @abstractmethod
+    async def prices(self, syms: list[str]) -> dict[str, float]: ...
+
+class AlphaVantageProvider(QuoteProvider):
+    name = "alphavantage"
+
+    async def prices(self, syms):
+        QUOTA.spent(QUOTA.calls_for(len(syms)))
+        return await QUOTES.prices(syms)
+
+class YahooProvider(QuoteProvider):
+    """Yahoo chart endpoint, one keyless request per symbol; NSE tickers take a suffix."""
+    name = "yahoo"
+    URL  = "https://query1.finance.yahoo.com/v8/finance/chart/{}"
+
+    def __init__(self, suffix=YAHOO_SUFFIX):
+        self.suffix = suffix
+
+    async def _one(self, sym):
+        j = await QUOTES.get_json(self.URL.format(sym + self.suffix), {"range": "1d", "interval": "1d"})
+        try: return float(j["chart"]["result"][0]["meta"]["regularMarketPrice"])
+        except (KeyError, IndexError, TypeError, ValueError): return None
+
+    async def prices(self, syms):
+        got = await asyncio.gather(*(self._one(s) for s in syms))
+        return {s: p for s, p in zip(syms, got) if p is not None}
+
+class SQLiteQuoteProvider(QuoteProvider):
+    """Local stand-in: reads a quotes(symbol, price) table from a SQLite file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = f"sqlite:{path}"
+
+    def _read(self, syms):
+        with closing(sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)) as db:
+            return dict(db.execute(f"SELECT upper(symbol), price FROM quotes WHERE upper(symbol) IN "
+                                   f"({','.join('?'*len(syms))})", syms).fetchall())
+
+    async def prices(self, syms):
+        return await asyncio.to_thread(self._read, syms)
+
+class CircuitBreaker:
+    """Opens after `threshold` straight failures; after `cooldown` lets one trial through.
+    allow() claims that trial, so call it only right before actually calling the provider."""
+
+    def __init__(self, threshold=3, cooldown=30.0):
+        self.threshold, self.cooldown = threshold, cooldown
+        self.failures, self.opened_at = 0, 0.0
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.threshold: return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def available(self) -> bool:
+        st = self.state
+        return st == "closed" or (st == "half-open" and not self._trial)
+
+    def allow(self) -> bool:
+        if not self.available(): return False
+        if self.state == "half-open": self._trial = True
+        return True
+
+    def release(self):
+        """The trial call was abandoned (cancelled) without an outcome."""
+        self._trial = False
+
+    def success(self):
+        self.failures, self._trial = 0, False
+
+    def failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.failures >= self.threshold: self.opened_at = time.monotonic()
+
+class ProviderHealth:
+    """EWMA of latency and success; score favours providers that answer fast and often."""
+
+    def __init__(self, alpha=0.2):
+        self.alpha, self.latency, self.ok = alpha, 0.5, 1.0
+        self.calls = self.errors = 0
+
+    def record(self, secs: float, ok: bool):
+        a = self.alpha
+        self.calls += 1
+        self.errors += not ok
+        self.ok = (1 - a) * self.ok + a * ok
+        if ok: self.latency = (1 - a) * self.latency + a * secs
+
+    @property
+    def score(self) -> float:
+        return self.ok / (0.05 + self.latency)
+
+class QuoteSource:
+    """Failover over several providers: the healthiest allowed provider goes first, a
+    second is fired if it has not answered within `hedge_after`, the first good answer
+    wins, and symbols it lacked are asked of the next provider."""
+
+    def __init__(self, providers: list[QuoteProvider], hedge_after=HEDGE_SEC, deadline=QUOTE_DEADLINE):
+        self.providers = providers
+        self.hedge_after, self.deadline = hedge_after, deadline
+        self.breakers = {p.name: CircuitBreaker() for p in providers}
+        self.health   = {p.name: ProviderHealth() for p in providers}
+        self.hedges = 0
+
+    def _ranked(self) -> list[QuoteProvider]:
+        # config order breaks ties, so a healthy primary stays primary
+        return sorted(self.providers, key=lambda p: -self.health[p.name].score * (1.0 if p is self.providers[0] else 0.9))
+
+    async def _call(self, p: QuoteProvider, syms) -> dict[str, float]:
+        t0 = time.monotonic()
+        try:
+            got = await asyncio.wait_for(p.prices(syms), self.deadline)
+        except asyncio.CancelledError:
+            self.breakers[p.name].release()   # a hedge loser is not a failure
+            raise
+        except Exception as e:
+            self.breakers[p.name].failure()
+            self.health[p.name].record(time.monotonic() - t0, False)
+            log.warning("quote provider %s failed: %r", p.name, e)
+            raise
+        ok = bool(got) or not syms
+        (self.breakers[p.name].success if ok else self.breakers[p.name].failure)()
+        self.health[p.name].record(time.monotonic() - t0, ok)
+        return got
+
+    async def _race(self, syms, queue: list[QuoteProvider]) -> tuple[dict[str, float], list[QuoteProvider]]:
+        """First non-empty answer among queue, hedging after hedge_after; returns the rest unused."""
+        running: dict[asyncio.Task, QuoteProvider] = {}
+        try:
+            while queue or running:
+                if queue and (not running or len(running) < 2):
+                    p = queue.pop(0)
+                    if not self.breakers[p.name].allow(): continue
+                    if running: self.hedges += 1
+                    running[asyncio.ensure_future(self._call(p, syms))] = p
+                done, _ = await asyncio.wait(running, timeout=self.hedge_after if queue else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    running.pop(t)
+                    if not t.cancelled() and t.exception() is None and t.result():
+                        return t.result(), queue
+        finally:
+            for t in running: t.cancel()
+        return {}, queue
+
+    async def prices(self, syms) -> dict[str, float]:
+        syms = sorted(set(syms))
+        if not syms: return {}
+        queue = [p for p in self._ranked() if self.breakers[p.name].available()]
+        out = {}
+        while queue and len(out) < len(syms):
+            got, queue = await self._race([s for s in syms if s not in out], queue)
+            out.update(got)
+        if len(out) < len(syms):
+            log.warning("no provider priced %d of %d symbols", len(syms) - len(out), len(syms))
+        return out
+
+    def summary(self) -> str:
+        return ", ".join(f"{p.name}[{self.breakers[p.name].state} ok={h.ok:.2f} {h.latency*1000:.0f}ms "
+                         f"{h.calls}/{h.errors}err]" for p in self.providers for h in [self.health[p.name]]) \
+            + f", hedges={self.hedges}"
+
+def make_provider(spec: str) -> QuoteProvider:
+    if spec == "alphavantage": return AlphaVantageProvider()
+    if spec == "yahoo":        return YahooProvider()
+    if spec.startswith("sqlite:"): return SQLiteQuoteProvider(spec[len("sqlite:"):])
+    raise ValueError(f"unknown quote provider {spec!r}")
+
+QUOTE_SOURCE = QuoteSource([make_provider(p) for p in map(str.strip, QUOTE_PROVIDERS.split(","))
+                            if p and (p != "alphavantage" or ALPHA_KEY)])
+if not any(isinstance(p, AlphaVantageProvider) for p in QUOTE_SOURCE.providers):
+    QUOTA.per_min = QUOTA.per_day = 0   # the budget only models Alpha Vantage
+
+QUOTE_CACHE = QuoteCache(QUOTE_SOURCE.prices)
+
+async def fetch_prices(syms) -> dict[str, float]:
+    return await QUOTE_CACHE.get_many(syms)
+
+NSE_HOME = "https://www.nseindia.com"
+NSE_HDR  = {"user-agent": "Mozilla/5.0", "referer": NSE_HOME,
+            "accept": "application/json,text/plain,*/*", "accept-language": "en-US,en;q=0.9",
+            "accept-encoding": "gzip, deflate"}
+
+UNCHANGED = object()   # get_json: same payload as the previous fetch of that URL
+
+class FeedError(Exception):
+    """A feed request failed; status is the HTTP status, or "error" for network/decode errors."""
+
+    def __init__(self, status, msg=""):
+        super().__init__(msg or f"HTTP {status}")
+        self.status = status
+
+class NSEClient:
+    """Long-lived NSE session: warm sockets, cookies primed only when stale. Fetches are
+    conditional (ETag / Last-Modified) and a body identical to the last one is not decoded."""
+
+    def __init__(self, timeout=10, cookie_ttl=NSE_COOKIE_TTL):
+        self.timeout    = aiohttp.ClientTimeout(total=timeout)
+        self.cookie_ttl = cookie_ttl
+        self._sess: Optional[aiohttp.ClientSession] = None
+        self._primed_at = 0.0
+        self._prime_lock = asyncio.Lock()
+        self._seen: OrderedDict[str, tuple] = OrderedDict()   # url -> (etag, last-modified, body digest)
+        self.stats = {"requests": 0, "primes": 0, "errors": 0, "not_modified": 0, "unchanged": 0,
+                      "status": {}, "last_ms": 0.0, "avg_ms": 0.0}
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self._sess is None or self._sess.closed:
+            conn = aiohttp.TCPConnector(limit=8, keepalive_timeout=120)
+            self._sess = aiohttp.ClientSession(headers=NSE_HDR, connector=conn, timeout=self.timeout)
+            self._primed_at = 0.0
+        return self._sess
+
+    def _cookies_fresh(self) -> bool:
+        if time.monotonic() - self._primed_at > self.cookie_ttl:
+            return False
+        # the jar drops cookies on their own expiry, so an empty jar means re-prime
+        return bool(self._session().cookie_jar.filter_cookies(URL(NSE_HOME)))
+
+    async def _prime(self, force=False):
+        async with self._prime_lock:
+            if not force and self._cookies_fresh(): return
+            async with self._session().get(NSE_HOME, headers={"accept": "text/html"}) as resp:
+                await resp.read()
+            self._primed_at = time.monotonic()
+            self.stats["primes"] += 1
+
+    def _record(self, status, t0):
+        ms = (time.monotonic() - t0) * 1000
+        st = self.stats
+        st["requests"] += 1
+        st["status"][status] = st["status"].get(status, 0) + 1
+        st["last_ms"] = ms
+        st["avg_ms"]  = ms if st["requests"] == 1 else 0.9 * st["avg_ms"] + 0.1 * ms
+
+    def _validators(self, key: str) -> dict:
+        etag, modified, _ = self._seen.get(key, (None, None, None))
+        hdr = {}
+        if etag: hdr["if-none-match"] = etag
+        if modified: hdr["if-modified-since"] = modified
+        return hdr
+
+    def _unchanged(self, key: str, resp, body: bytes) -> bool:
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        prev = self._seen.pop(key, (None, None, None))
+        self._seen[key] = (resp.headers.get("etag"), resp.headers.get("last-modified"), digest)
+        while len(self._seen) > 64: self._seen.popitem(last=False)
+        return digest == prev[2]
+
+    async def get_json(self, path: str, params: dict, conditional=True):
+        """Decoded JSON, UNCHANGED if the body matches the previous one, or None on failure."""
+        try:
+            return await self.fetch_json(path, params, conditional)
+        except FeedError:
+            return None
+
+    async def fetch_json(self, path: str, params: dict, conditional=True):
+        """get_json, but a failure raises FeedError with the status that caused it."""
+        key = str(URL(NSE_HOME + path).with_query(params))
+        for attempt in range(2):
+            t0 = time.monotonic()
+            try:
+                await self._prime(force=attempt > 0)
+                hdr = self._validators(key) if conditional else {}
+                async with self._session().get(NSE_HOME + path, params=params, headers=hdr) as resp:
+                    self._record(resp.status, t0)
+                    if resp.status == 304:
+                        self.stats["not_modified"] += 1
+                        return UNCHANGED
+                    if resp.status == 200:
+                        body = await resp.read()
+                        if self._unchanged(key, resp, body) and conditional:
+                            self.stats["unchanged"] += 1
+                            return UNCHANGED
+                        return json.loads(body)
+                    if resp.status not in (401, 403):
+                        log.warning("NSE %s -> HTTP %s", path, resp.status)
+                        raise FeedError(resp.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                self._record("error", t0)
+                self.stats["errors"] += 1
+                log.warning("NSE %s failed: %r", path, e)
+                raise FeedError("error", repr(e)) from e
+        log.warning("NSE %s still forbidden after cookie refresh", path)
+        raise FeedError(resp.status)
+
+    def forget(self):
+        self._seen.clear()
+
+    async def announcements(self, index="equities") -> Optional[list]:
+        """Current announcements, or None when the feed has not changed since the last poll;
+        raises FeedError when the request fails."""
+        data = await self.fetch_json("/api/corporate-announcements", {"index": index})
+        if data is UNCHANGED: return None
+        return data.get("data", []) if isinstance(data, dict) else (data or [])
+
+    def summary(self) -> str:
+        st = self.stats
+        return (f"req={st['requests']} primes={st['primes']} err={st['errors']} "
+                f"noop={st['not_modified'] + st['unchanged']} (304={st['not_modified']}) "
+                f"last={st['last_ms']:.0f}ms avg={st['avg_ms']:.0f}ms status={st['status']}")
+
+    async def close(self):
+        if self._sess and not self._sess.closed:
+            await self._sess.close()
+
+NSE = NSEClient()
+
+# Filing feeds: every source is normalized to one record
+#   {"id", "source", "symbol", "headline", "subject", "filed_at", "words"}
+# where id is unique per source and words is the headline's content tokens, used
+# by CrossSourceDedup to spot the same filing arriving from another exchange.
+
+def _filed_at(text: str, fmts) -> float:
+    for fmt in fmts:
+        with suppress(ValueError, TypeError):
+            return datetime.strptime(text, fmt).replace(tzinfo=ZoneInfo(NSE_TZ)).timestamp()
+    return time.time()
+
+# exchange boilerplate that says nothing about which filing it is
+DEDUP_STOP = frozenset("""a an and are as at be by for from has have in is of on or the this that to
+    with about regarding informed exchange limited ltd company pursuant under regulation regulations
+    reg sebi lodr intimation disclosure submission""".split())
+
+def headline_words(text: str) -> frozenset:
+    words = "".join(c if c.isalnum() else " " for c in (text or "").lower()).split()
+    return frozenset(w for w in words if len(w) > 1 and w not in DEDUP_STOP)
+
+def filing(source: str, ref, symbol: str, headline: str, subject: str, filed_at: float) -> dict:
+    return {"id": str(ref) if source == "nse:equities" else f"{source}:{ref}",   # nse ids predate sources
+            "source": source, "symbol": symbol.upper(), "headline": headline, "subject": subject,
+            "filed_at": filed_at, "words": headline_words(headline or subject)}
+
+class CrossSourceDedup:
+    """Recognises one company filing delivered by several exchanges. The exchanges share
+    no filing id and word their headlines differently (NSE's attchmntText is usually a
+    sentence around the company's text, BSE's HEADLINE a "Company - Category - text"
+    line), so two records count as one filing when they are for the same symbol, come
+    from different sources, were filed within DEDUP_WINDOW of each other and share at
+    least `min_shared` content words making up `overlap` of the shorter headline.
+    Bare category headlines ("Press Release") share too little to merge, which errs
+    on the side of a duplicate alert rather than a lost one. Same-source records are
+    never merged; they dedup by id alone."""
+
+    def __init__(self, window=DEDUP_WINDOW, overlap=0.6, min_shared=3):
+        self.window, self.overlap, self.min_shared = window, overlap, min_shared
+        self._recent: dict[str, deque] = {}   # symbol -> (filed_at, source, words)
+
+    async def warm(self):
+        """Reload recently delivered filings from the outbox, whose keys carry the source id."""
+        rows = await STORE.read("SELECT key, symbol, headline, strftime('%s', created) FROM outbox "
+                                "WHERE key LIKE 'filing:%' AND created >= datetime('now', ?)",
+                                (f"-{2 * self.window} seconds",))
+        seen = set()
+        for key, sym, hl, at in rows:
+            fid = key[len("filing:"):].rsplit(":", 1)[0]
+            if (fid, sym) in seen or not sym: continue
+            seen.add((fid, sym))
+            src = fid.rsplit(":", 1)[0] if ":" in fid else "nse:equities"
+            self.add([{"symbol": sym, "source": src, "filed_at": float(at), "words": headline_words(hl)}])
+
+    def _same(self, a: frozenset, b: frozenset) -> bool:
+        shared = len(a & b)
+        return shared >= self.min_shared and shared >= self.overlap * min(len(a), len(b))
+
+    def duplicate(self, row: dict, batch=()) -> bool:
+        """row repeats a filing already delivered, or kept earlier in `batch`, by another source."""
+        cands = list(self._recent.get(row["symbol"], ()))
+        cands += [(r["filed_at"], r["source"], r["words"]) for r in batch if r["symbol"] == row["symbol"]]
+        return any(src != row["source"] and abs(at - row["filed_at"]) <= self.window
+                   and self._same(words, row["words"]) for at, src, words in cands)
+
+    def add(self, rows):
+        for r in rows:
+            dq = self._recent.setdefault(r["symbol"], deque(maxlen=64))
+            dq.append((r["filed_at"], r["source"], r["words"]))
+            while dq and dq[0][0] < r["filed_at"] - 2 * self.window: dq.popleft()
+
+CROSS = CrossSourceDedup()
+
+def nse_filing(row: dict, source="nse:equities") -> dict:
+    return filing(source, row.get("id") or row.get("seq_id"), row["symbol"],
+                  row.get("headline") or row.get("attchmntText") or row.get("desc", ""), row.get("desc"),
+                  _filed_at(row.get("sort_date") or row.get("an_dt"), ("%Y-%m-%d %H:%M:%S", "%d-%b-%Y %H:%M:%S")))
+
+class FilingFeed(ABC):
+    """One announcements source; fetch() returns records, None when unchanged, and raises on failure."""
+    name = "base"
+
+    @abstractmethod
+    async def fetch(self) -> Optional[list]: ...
+
+    def forget(self):
+        """Drop change detection state so the next fetch is dispatched in full."""
+
+    async def close(self): pass
+
+class NSEFeed(FilingFeed):
+    def __init__(self, index: str):
+        self.index, self.name = index, f"nse:{index}"
+
+    async def fetch(self):
+        rows = await NSE.announcements(self.index)
+        return None if rows is None else [nse_filing(r, self.name) for r in rows if r.get("symbol")]
+
+    def forget(self):
+        NSE.forget()
+
+class BSEFeed(FilingFeed):
+    """BSE corporate announcements for today; scrip codes map to NSE symbols through
+    BSE_SYMBOLS. A body identical to the previous one is reported as unchanged."""
+    name = "bse"
+    URL  = "https://api.bseindia.com/BseIndiaAPI/api/AnnSubCategoryGetData/w"
+    HDR  = {"user-agent": "Mozilla/5.0", "referer": "https://www.bseindia.com/",
+            "origin": "https://www.bseindia.com", "accept": "application/json"}
+
+    def __init__(self, symbols=BSE_SYMBOLS, timeout=10):
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._sess: Optional[aiohttp.ClientSession] = None
+        self._digest = None
+        self.symbols = {}
+        if symbols and os.path.isfile(symbols):
+            with open(symbols) as f: symbols = f.read()
+        for entry in symbols.replace(";", "\n").splitlines():
+            code, _, sym = entry.strip().partition(",")
+            if sym and not code.startswith("#"): self.symbols[code.strip()] = sym.strip().upper()
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self._sess is None or self._sess.closed:
+            self._sess = aiohttp.ClientSession(headers=self.HDR, timeout=self.timeout)
+        return self._sess
+
+    async def fetch(self):
+        day = datetime.now(ZoneInfo(NSE_TZ)).strftime("%Y%m%d")
+        params = {"pageno": 1, "strCat": -1, "strPrevDate": day, "strToDate": day, "strScrip": "",
+                  "strSearch": "P", "strType": "C", "subcategory": -1}
+        async with self._session().get(self.URL, params=params) as resp:
+            if resp.status != 200:
+                raise FeedError(resp.status, f"BSE announcements -> HTTP {resp.status}")
+            body = await resp.read()
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        if digest == self._digest: return None
+        data = json.loads(body)
+        self._digest, out = digest, []
+        for r in (data or {}).get("Table") or []:
+            code = str(r.get("SCRIP_CD", ""))
+            if not r.get("NEWSID"): continue    # no id, no way to dedup it
+            out.append(filing("bse", r.get("NEWSID"), self.symbols.get(code, code),
+                              r.get("HEADLINE") or r.get("NEWSSUB", ""), r.get("SUBCATNAME") or r.get("CATEGORYNAME"),
+                              _filed_at(r.get("NEWS_DT") or r.get("DT_TM"),
+                                        ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"))))
+        return out
+
+    def forget(self):
+        self._digest = None
+
+    async def close(self):
+        if self._sess and not self._sess.closed:
+            await self._sess.close()
+
+class FilingIngest:
+    """Polls every feed concurrently and merges the records; tracks per-source lag,
+    i.e. how long after filing a new record reached dispatch."""
+
+    def __init__(self, feeds: list[FilingFeed]):
+        self.feeds = feeds
+        self.sources = [f.name for f in feeds]
+        self.stats = {f.name: {"polls": 0, "rows": 0, "new": 0, "lag": None, "newest": 0.0} for f in feeds}
+
+    async def poll(self) -> tuple[Optional[list], dict]:
+        """(merged records or None if no feed changed, {feed: status}); status is 200,
+        304 for unchanged, the failing HTTP status, or "error"."""
+        got = await asyncio.gather(*(f.fetch() for f in self.feeds), return_exceptions=True)
+        rows, changed, status = [], False, {}
+        for f, res in zip(self.feeds, got):
+            st = self.stats[f.name]
+            st["polls"] += 1
+            if isinstance(res, BaseException):
+                if not isinstance(res, Exception): raise res
+                log.warning("filing feed %s failed: %r", f.name, res)
+                status[f.name] = res.status if isinstance(res, FeedError) else "error"
+                continue
+            status[f.name] = 304 if res is None else 200
+            if res is None: continue
+            changed = True
+            st["rows"] += len(res)
+            st["newest"] = max([st["newest"]] + [r["filed_at"] for r in res])
+            rows += res
+        return (rows if changed else None), status
+
+    @staticmethod
+    def worst(status: dict):
+        """The status the poll cadence should react to: throttling first, then any failure."""
+        bad = [s for s in status.values() if s not in (200, 304)]
+        return next((s for s in bad if s in (403, 429)), bad[0] if bad else 200)
+
+    def delivered(self, rows: list):
+        now = time.time()
+        for r in rows:
+            st = self.stats.get(r["source"])
+            if st is None: continue
+            lag = max(0.0, now - r["filed_at"])
+            st["new"] += 1
+            st["lag"] = lag if st["lag"] is None else 0.8 * st["lag"] + 0.2 * lag
+
+    def summary(self) -> str:
+        return ", ".join(f"{n}[new={st['new']}/{st['rows']} lag={st['lag'] or 0:.0f}s]" for n, st in self.stats.items())
+
+    def forget(self):
+        for f in self.feeds: f.forget()
+
+    async def close(self):
+        for f in self.feeds: await f.close()
+
+def make_feed(spec: str) -> FilingFeed:
+    if spec.startswith("nse:"): return NSEFeed(spec[4:])
+    if spec == "bse": return BSEFeed()
+    raise ValueError(f"unknown filing feed {spec!r}")
+
+INGEST = FilingIngest([make_feed(f.strip()) for f in FILING_FEEDS.split(",") if f.strip()])
+
+# ──────────── Delivery ──────────── #
+
+class TokenBucket:
+    """`rate` tokens/s up to `burst`; callers reserve a token and sleep off any debt."""
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate, self.burst = rate, burst
+        self.tokens = burst
+        self.stamp  = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp  = now
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    async def take(self):
+        wait = self.reserve()
+        if wait: await asyncio.sleep(wait)
+
+def _retry_secs(e: RetryAfter) -> float:
+    ra = e.retry_after
+    return ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+
+async def unsubscribe_user(uid: int):
+    def run(db):
+        syms = [r[0] for r in db.execute("SELECT symbol FROM watch WHERE user=?", (uid,))]
+        alerts = db.execute("SELECT id,symbol,op,threshold FROM price_alerts WHERE user=?", (uid,)).fetchall()
+        db.execute("DELETE FROM watch WHERE user=?", (uid,))
+        db.execute("DELETE FROM price_alerts WHERE user=?", (uid,))
+        return syms, alerts
+    syms, alerts = await STORE.tx(run)
+    for sym in syms:
+        SUBS.remove(uid, sym)
+    for rid, sym, op, thr in alerts:
+        BOOK.remove(rid, sym, op, thr)
+
+class Sender:
+    """Fan-out over a bounded worker pool, paced by global and per-chat token buckets."""
+
+    def __init__(self, workers=SEND_WORKERS, global_rate=SEND_RATE, chat_rate=CHAT_RATE, retries=3):
+        self.workers = workers
+        self.retries = retries
+        self.chat_rate = chat_rate
+        self._global = TokenBucket(global_rate, burst=global_rate)
+        self._chats: dict[int, TokenBucket] = {}
+        self._pause_until = 0.0    # set by a flood-wait; holds every worker
+        self.last: dict = {}
+
+    def _chat(self, chat_id: int) -> TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            if len(self._chats) > 50_000:   # drop buckets that have fully refilled
+                now = time.monotonic()
+                self._chats = {k: v for k, v in self._chats.items() if now - v.stamp < 1 / v.rate}
+            b = self._chats[chat_id] = TokenBucket(self.chat_rate)
+        return b
+
+    async def _send_one(self, bot, chat_id, text, kw) -> str:
+        for attempt in range(self.retries + 1):
+            await self._chat(chat_id).take()
+            pause = self._pause_until - time.monotonic()
+            if pause > 0: await asyncio.sleep(pause)
+            await self._global.take()
+            try:
+                await bot.send_message(chat_id, text, **kw)
+                return "sent"
+            except RetryAfter as e:
+                wait = _retry_secs(e)
+                self._pause_until = max(self._pause_until, time.monotonic() + wait)
+                log.warning("flood control: pausing sends for %.0fs", wait)
+            except Forbidden:
+                log.info("user %s blocked the bot; unsubscribing", chat_id)
+                await unsubscribe_user(chat_id)
+                return "blocked"
+            except (TimedOut, NetworkError):
+                if attempt == self.retries: break
+                await asyncio.sleep(random.uniform(0, 0.5 * 2 ** attempt))
+            except TelegramError as e:
+                log.warning("send to %s failed: %s", chat_id, e)
+                return "failed"
+        return "failed"
+
+    async def send_batch(self, bot, msgs: list) -> list[str]:
+        """Deliver (chat_id, text, kwargs) tuples; returns one outcome per message."""
+        results = [None] * len(msgs)
+        if not msgs: return results
+        queue = asyncio.Queue()
+        for i, m in enumerate(msgs): queue.put_nowait((i, m))
+        t0 = time.monotonic()
+
+        async def worker():
+            while True:
+                try: i, (chat_id, text, kw) = queue.get_nowait()
+                except asyncio.QueueEmpty: return
+                try: results[i] = await self._send_one(bot, chat_id, text, kw)
+                except Exception:
+                    log.exception("send to %s crashed", chat_id)
+                    results[i] = "failed"
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(msgs)))))
+        secs = time.monotonic() - t0
+        self.last = {k: results.count(k) for k in ("sent", "blocked", "failed")}
+        self.last.update(total=len(msgs), secs=round(secs, 2), rate=round(len(msgs) / max(secs, 1e-6), 1))
+        log.info("fan-out: %(total)d msgs in %(secs).2fs (%(rate).1f/s) "
+                 "sent=%(sent)d blocked=%(blocked)d failed=%(failed)d", self.last)
+        return results
+
+SENDER = Sender()
+
+# Outbox: producers enqueue inside their own transaction, drain_outbox delivers
+# at-least-once. `key` is the idempotency key, so re-enqueueing is a no-op.
+
+def enqueue(db, items):
+    """Queue (key, user, text, parse_mode, symbol, headline) rows; call from a STORE.tx
+    job so they commit together with the caller's other writes."""
+    db.executemany("INSERT OR IGNORE INTO outbox(key,user,text,parse_mode,symbol,headline) "
+                   "VALUES(?,?,?,?,?,?)", items)
+
+class AlertLog:
+    """Delivered-alert history, buffered off the send path and written with
+    executemany once `batch` rows pile up or every `interval` seconds."""
+
+    def __init__(self, batch=ALERTLOG_BATCH, interval=ALERTLOG_SEC):
+        self.batch, self.interval = batch, interval
+        self._buf: list[tuple] = []
+        self._flushing: Optional[asyncio.Task] = None
+        self.rows = self.flushes = 0
+
+    def add(self, rows):
+        """rows: (user, symbol, headline); stamped now so a late flush keeps delivery time."""
+        ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        self._buf.extend((u, s, h, ts) for u, s, h in rows)
+        if len(self._buf) >= self.batch and not (self._flushing and not self._flushing.done()):
+            self._flushing = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        while self._buf:
+            buf, self._buf = self._buf, []
+            try:
+                await STORE.write_many("INSERT INTO alerts(user,symbol,headline,ts) VALUES(?,?,?,?)", buf)
+            except Exception:
+                log.exception("alert history flush of %d rows failed; keeping them", len(buf))
+                self._buf[:0] = buf
+                return
+            self.rows += len(buf)
+            self.flushes += 1
+
+ALERT_LOG = AlertLog()
+
+_drain_lock = asyncio.Lock()
+_drain_again = False
+
+async def _drain_pass(app):
+    last_id = 0
+    while True:
+        rows = await STORE.read(
+            "SELECT id,user,text,parse_mode,symbol,headline,attempts FROM outbox "
+            "WHERE status='pending' AND id>? AND next_at<=? ORDER BY id LIMIT ?",
+            (last_id, time.time(), OUTBOX_BATCH))
+        if not rows: return
+        last_id = rows[-1][0]
+        results = await SENDER.send_batch(app.bot, [
+            (uid, text, {"parse_mode": pm} if pm else {}) for _,uid,text,pm,_,_,_ in rows])
+        now = time.time()
+        sent, closed, retry = [], [], []
+        for (oid,uid,_,_,sym,hl,att), res in zip(rows, results):
+            if res == "sent":
+                sent.append((oid,))
+                if sym is not None: ALERT_LOG.add([(uid, sym, hl)])
+            elif res == "blocked" or att + 1 >= OUTBOX_MAX_ATTEMPTS:
+                closed.append(("dropped" if res == "blocked" else "dead", oid))
+            else:
+                retry.append((now + 5 * 2 ** att, oid))
+
+        def settle(db):
+            db.executemany("UPDATE outbox SET status='sent', sent_at=CURRENT_TIMESTAMP WHERE id=?", sent)
+            db.executemany("UPDATE outbox SET status=? WHERE id=?", closed)
+            db.executemany("UPDATE outbox SET attempts=attempts+1, next_at=? WHERE id=?", retry)
+        await STORE.tx(settle)
+
+async def drain_outbox(app):
+    """Deliver pending outbox rows; a call while draining just schedules one more pass."""
+    global _drain_again
+    _drain_again = True
+    if _drain_lock.locked(): return
+    async with _drain_lock:
+        while _drain_again:
+            _drain_again = False
+            await _drain_pass(app)
+
+async def prune_outbox():
+    await STORE.write("DELETE FROM outbox WHERE status!='pending' AND created < datetime('now', ?)",
+                      (f"-{OUTBOX_KEEP_DAYS} days",))
 
 # ─────────────── Command & Callback Handlers ─────────────── #
 
@@ -83,10 +1317,14 @@ async def cmd_help(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         "/watch SYMBOL [SYMBOL ...] — track symbols\n"
         "/unwatch SYMBOL [SYMBOL ...] — stop tracking\n"
         "/list — list subscriptions\n"
+        "/price SYMBOL [SYMBOL ...] — current quote\n"
         "/pricealert SYM > 123 — set price alert\n"
         "/view_price_alerts — view & remove your price alerts\n"
         "/alertslist — view today's filing alerts\n"
         "/digest — send today's digest now\n"
+        "/digesttime HH:MM [Area/City] — when your daily digest arrives\n"
+        "/filter SYMBOL|* word, #category, … — only filings matching these\n"
+        "/unfilter SYMBOL|* — drop those filters; /filters — list them\n"
     )
     await update.message.reply_text(text)
 
@@ -94,46 +1332,91 @@ async def cmd_help(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
 async def cmd_watch_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     syms = [s.upper() for s in ctx.args]
-    added = []
-    for sym in syms:
-        try:
-            DB.execute("INSERT OR IGNORE INTO watch(user,symbol) VALUES(?,?)",
-                       (update.effective_user.id, sym))
-            added.append(sym)
-        except:
-            continue
-    DB.commit()
+    added = list(dict.fromkeys(syms))
+    await STORE.write_many("INSERT OR IGNORE INTO watch(user,symbol) VALUES(?,?)",
+                           [(update.effective_user.id, sym) for sym in added])
+    for sym in added:
+        SUBS.add(update.effective_user.id, sym)
+    DIGEST.ensure(update.effective_user.id)
     await update.message.reply_text(f"Tracking: {' '.join(added)}")
 
 async def cmd_unwatch_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     syms = [s.upper() for s in ctx.args]
+    await STORE.write_many("DELETE FROM watch WHERE user=? AND symbol=?",
+                           [(update.effective_user.id, sym) for sym in syms])
     for sym in syms:
-        DB.execute("DELETE FROM watch WHERE user=? AND symbol=?",
-                   (update.effective_user.id, sym))
-    DB.commit()
+        SUBS.remove(update.effective_user.id, sym)
     await update.message.reply_text(f"Stopped: {' '.join(syms)}")
 
+# Filing filters
+
+async def cmd_filter(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    uid = update.effective_user.id
+    pats = [p.strip().lower() for p in " ".join(ctx.args[1:]).split(",") if p.strip()]
+    bad  = [p for p in pats if p.startswith("#") and p[1:] not in CATEGORIES]
+    if not pats or bad:
+        return await update.message.reply_text(
+            "Usage: /filter SYMBOL|* word, #category, …\nCategories: " + " ".join("#" + c for c in CATEGORIES))
+    sym = ctx.args[0].upper()
+    await STORE.write_many("INSERT OR IGNORE INTO filing_filters(user,symbol,pattern) VALUES(?,?,?)",
+                           [(uid, sym, p) for p in pats])
+    FILTERS.add(uid, sym, pats)
+    await update.message.reply_text(f"{sym}: only filings matching {', '.join(sorted(FILTERS.rules(uid)[sym]))}")
+
+async def cmd_unfilter(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if not ctx.args:
+        return await update.message.reply_text("Usage: /unfilter SYMBOL|*")
+    uid, sym = update.effective_user.id, ctx.args[0].upper()
+    await STORE.write("DELETE FROM filing_filters WHERE user=? AND symbol=?", (uid, sym))
+    FILTERS.clear(uid, sym)
+    await update.message.reply_text(f"{sym}: all filings")
+
+async def cmd_filters(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    rules = FILTERS.rules(update.effective_user.id)
+    await update.message.reply_text("Filters:\n" + ("\n".join(f"{s}: {', '.join(sorted(p))}" for s, p in sorted(rules.items()))
+                                                    if rules else "(none — every filing is sent)"))
+
 # List subscriptions
 
 async def cmd_list(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    rows = DB.execute("SELECT symbol FROM watch WHERE user=?",
-                      (update.effective_user.id,)).fetchall()
+    rows = await STORE.read("SELECT symbol FROM watch WHERE user=?",
+                            (update.effective_user.id,))
     syms = [r[0] for r in rows]
     await update.message.reply_text("Subscriptions:\n" + ("\n".join(syms) if syms else "(none)"))
 
 # Filing alerts
 
 async def cmd_alertslist(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    today = date.today().isoformat()
-    rows = DB.execute(
-        "SELECT symbol,headline FROM alerts WHERE user=? AND date(ts)=?",
-        (update.effective_user.id, today)
-    ).fetchall()
+    tz, _ = DIGEST.pref(update.effective_user.id)   # "today" as /digest sees it
+    rows = await STORE.read(
+        "SELECT symbol,headline FROM alerts WHERE user=? AND ts>=? AND ts<? ORDER BY ts",
+        (update.effective_user.id, *local_day_range(tz, datetime.now(tz).date())))
     lines = [f"{s}: {h}" for s,h in rows]
-    await update.message.reply_text("Today's alerts:\n" + ("\n".join(lines) if lines else "(none)"))
+    await update.effective_message.reply_text("Today's alerts:\n" + ("\n".join(lines) if lines else "(none)"))
 
 async def cmd_digest(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    await cmd_alertslist(update, ctx)
+    tz, _ = DIGEST.pref(update.effective_user.id)
+    today = datetime.now(tz).date()
+    rows = await STORE.read(
+        "SELECT symbol,headline FROM alerts WHERE user=? AND ts>=? AND ts<? ORDER BY ts",
+        (update.effective_user.id, *local_day_range(tz, today)))
+    if not rows:
+        return await update.effective_message.reply_text("No alerts today.")
+    await update.effective_message.reply_text(render_digest(today.isoformat(), rows), parse_mode="HTML")
+
+async def cmd_digesttime(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    uid = update.effective_user.id
+    try:
+        at = ctx.args[0]
+        hh, mm = map(int, at.split(":"))
+        if not (0 <= hh < 24 and 0 <= mm < 60): raise ValueError
+        tz = ctx.args[1] if len(ctx.args) > 1 else DIGEST.pref(uid)[0].key
+        ZoneInfo(tz)
+    except (IndexError, ValueError, ZoneInfoNotFoundError):
+        return await update.message.reply_text("Usage: /digesttime HH:MM [Area/City]")
+    at = f"{hh:02d}:{mm:02d}"
+    await DIGEST.set_pref(uid, tz, at)
+    await update.message.reply_text(f"Daily digest at {at} ({tz})")
 
 # Price alert via text
 
@@ -143,18 +1426,26 @@ async def cmd_pricealert_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         if op not in (">","<"): raise ValueError
     except:
         return await update.message.reply_text("Usage: /pricealert SYMBOL > 123.45")
-    DB.execute("INSERT INTO price_alerts(user,symbol,op,threshold) VALUES(?,?,?,?)",
-               (update.effective_user.id, sym, op, thr))
-    DB.commit()
+    rid = await STORE.tx(lambda db: db.execute(
+        "INSERT INTO price_alerts(user,symbol,op,threshold) VALUES(?,?,?,?)",
+        (update.effective_user.id, sym, op, thr)).lastrowid)
+    BOOK.add(rid, update.effective_user.id, sym, op, thr)
     await update.message.reply_text(f"Price alert set: {sym} {op} {thr}")
 
+async def cmd_price(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if not ctx.args:
+        return await update.message.reply_text("Usage: /price SYMBOL [SYMBOL ...]")
+    prices = await fetch_prices(s.upper() for s in ctx.args)
+    lines = [f"{s}: {prices[s]:.2f}" if s in prices else f"{s}: n/a"
+             for s in dict.fromkeys(a.upper() for a in ctx.args)]
+    await update.message.reply_text("\n".join(lines))
+
 # View & remove price alerts
 
 async def cmd_view_price_alerts(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    rows = DB.execute(
+    rows = await STORE.read(
         "SELECT symbol,op,threshold FROM price_alerts WHERE user=?",
-        (update.effective_user.id,)
-    ).fetchall()
+        (update.effective_user.id,))
     if not rows:
         return await update.message.reply_text("No active price alerts.")
     kb=[]
@@ -166,9 +1457,15 @@ async def cmd_view_price_alerts(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
 async def cb_remove_price_alert(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     _,sym,op,thr = update.callback_query.data.split("_",3)
-    DB.execute("DELETE FROM price_alerts WHERE user=? AND symbol=? AND op=? AND threshold=?",
-               (update.effective_user.id, sym, op, float(thr)))
-    DB.commit()
+    q = ("FROM price_alerts WHERE user=? AND symbol=? AND op=? AND threshold=?",
+         (update.effective_user.id, sym, op, float(thr)))
+
+    def remove(db):
+        ids = [r[0] for r in db.execute("SELECT id " + q[0], q[1])]
+        db.execute("DELETE " + q[0], q[1])
+        return ids
+    for rid in await STORE.tx(remove):
+        BOOK.remove(rid, sym, op, float(thr))
     await update.callback_query.answer(f"Removed {sym} {op} {thr}")
 
 async def cb_done_pa(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
@@ -198,50 +1495,876 @@ async def cb_menu_router(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
 # ──────────── Background Tasks ──────────── #
 
-async def dispatch_filings(app):
-    data = await fetch_nse_announcements()
-    fresh=[]
-    for row in data:
-        uid=row["id"]
-        if uid == getattr(dispatch_filings, "_last", None):
-            break
-        fresh.append(row)
+class SubscriptionIndex:
+    """symbol -> sorted array of watcher ids; loaded once, then kept in step with `watch`."""
+
+    def __init__(self):
+        self._by_sym: dict[str, array] = {}
+
+    async def load(self):
+        by_sym = {}
+        for u, s in await STORE.read("SELECT user,symbol FROM watch ORDER BY symbol,user"):
+            by_sym.setdefault(s, array("q")).append(u)
+        self._by_sym = by_sym
+        log.info("subscription index: %d symbols, %d watches", len(by_sym), len(self))
+
+    def __len__(self):
+        return sum(map(len, self._by_sym.values()))
+
+    def users(self) -> set[int]:
+        return set().union(*self._by_sym.values())
+
+    def watchers(self, sym: str):
+        return self._by_sym.get(sym, ())
+
+    def add(self, uid: int, sym: str):
+        arr = self._by_sym.setdefault(sym, array("q"))
+        i = bisect_left(arr, uid)
+        if i == len(arr) or arr[i] != uid:
+            arr.insert(i, uid)
+
+    def remove(self, uid: int, sym: str):
+        arr = self._by_sym.get(sym)
+        if not arr: return
+        i = bisect_left(arr, uid)
+        if i < len(arr) and arr[i] == uid:
+            del arr[i]
+            if not arr: del self._by_sym[sym]
+
+    async def check(self, repair=True) -> int:
+        """Compare against the watch table; returns the number of differing pairs."""
+        db  = set(await STORE.read("SELECT user,symbol FROM watch"))
+        mem = {(u, s) for s, arr in self._by_sym.items() for u in arr}
+        diff = len(db ^ mem)
+        if diff:
+            log.warning("subscription index drifted by %d pairs%s", diff, "; reloading" if repair else "")
+            if repair: await self.load()
+        return diff
+
+SUBS = SubscriptionIndex()
+
+async def check_subscriptions():
+    await SUBS.check()
+
+CATEGORIES = {
+    "results":  ["financial result", "financial results", "quarterly result", "audited result", "unaudited"],
+    "board":    ["board meeting", "outcome of board"],
+    "dividend": ["dividend", "record date"],
+    "agm":      ["agm", "egm", "annual general meeting", "postal ballot"],
+    "buyback":  ["buyback", "buy back", "buy-back"],
+    "bonus":    ["bonus", "stock split", "sub-division", "split"],
+    "merger":   ["merger", "amalgamation", "scheme of arrangement", "acquisition", "demerger"],
+    "insider":  ["insider trading", "sast", "pledge", "encumbrance"],
+    "rating":   ["credit rating", "rating"],
+    "order":    ["order", "contract", "bagging", "award"],
+}
+
+class KeywordAutomaton:
+    """Aho-Corasick over lower-case keywords: one pass over a text finds every keyword
+    in it, however many there are. Words are refcounted; adding one extends the trie
+    in place, and the next search relinks the failure links of the whole trie once
+    (so a burst of adds costs one O(trie) pass, not one per word). Removed words are
+    hidden at once and the trie is compacted when they outnumber live ones."""
+
+    def __init__(self):
+        self._refs: dict[str, int] = {}
+        self._dead = 0
+        self._reset()
+
+    def _reset(self):
+        self._goto: list[dict[str, int]] = [{}]
+        self._word: list[Optional[str]] = [None]
+        self._fail, self._out = [0], [()]
+        self._dirty = False
+
+    def _insert(self, word: str):
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = self._goto[node][ch] = len(self._goto)
+                self._goto.append({}); self._word.append(None)
+            node = nxt
+        self._word[node] = word
+        self._dirty = True
+
+    def add(self, word: str):
+        if word in self._refs:
+            self._refs[word] += 1
+            return
+        self._refs[word] = 1
+        self._insert(word)   # a previously removed word is simply re-marked
+
+    def discard(self, word: str):
+        n = self._refs.get(word, 0) - 1
+        if n > 0: self._refs[word] = n
+        elif n == 0:
+            del self._refs[word]
+            self._dead += 1
+            if self._dead > len(self._refs):
+                self._reset()
+                self._dead = 0
+                for w in self._refs: self._insert(w)
+
+    def _link(self):
+        goto, n = self._goto, len(self._goto)
+        fail, out = [0] * n, [()] * n
+        q = deque(goto[0].values())
+        for v in q: out[v] = (self._word[v],) if self._word[v] else ()
+        while q:
+            u = q.popleft()
+            for ch, v in goto[u].items():
+                f = fail[u]
+                while f and ch not in goto[f]: f = fail[f]
+                fail[v] = goto[f][ch] if ch in goto[f] and goto[f][ch] != v else 0
+                out[v] = ((self._word[v],) if self._word[v] else ()) + out[fail[v]]
+                q.append(v)
+        self._fail, self._out, self._dirty = fail, out, False
+
+    def search(self, text: str) -> set[str]:
+        """Keywords occurring in text at a word start (so "result" also hits "results")."""
+        if self._dirty: self._link()
+        goto, fail, out, refs = self._goto, self._fail, self._out, self._refs
+        text, node, hits = text.lower(), 0, set()
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]: node = fail[node]
+            node = goto[node].get(ch, 0)
+            for w in out[node]:
+                j = i - len(w)
+                if w in refs and (j < 0 or not text[j].isalnum()): hits.add(w)
+        return hits
+
+    def __len__(self):
+        return len(self._refs)
+
+class FilterBook:
+    """Per-user filing filters: (user, symbol or '*') -> patterns. Watchers without a
+    rule get every filing; with rules, only filings whose headline or subject hits one
+    of them. All patterns share one KeywordAutomaton, so a filing is matched once for
+    every user, and each hit keyword maps back to the rules that own it."""
+
+    def __init__(self):
+        self._rules: dict[tuple[int, str], set[str]] = {}
+        self._owners: dict[str, set[tuple[int, str]]] = {}   # keyword -> rules
+        self._users: set[int] = set()
+        self.auto = KeywordAutomaton()
+
+    async def load(self):
+        self.__init__()
+        rows = await STORE.read("SELECT user,symbol,pattern FROM filing_filters")
+        for uid, sym, pat in rows: self.add(uid, sym, [pat])
+        log.info("filing filters: %d rules, %d keywords", len(rows), len(self.auto))
+
+    @staticmethod
+    def _words(pat: str) -> list[str]:
+        return CATEGORIES.get(pat[1:], []) if pat.startswith("#") else [pat]
+
+    def add(self, uid: int, sym: str, pats):
+        rule = (uid, sym)
+        have = self._rules.setdefault(rule, set())
+        for pat in pats:
+            if pat in have: continue
+            have.add(pat)
+            for w in self._words(pat):
+                owners = self._owners.setdefault(w, set())
+                if not owners: self.auto.add(w)
+                owners.add(rule)
+        self._users.add(uid)
+
+    def clear(self, uid: int, sym: str):
+        rule = (uid, sym)
+        words = {w for pat in self._rules.pop(rule, ()) for w in self._words(pat)}
+        for w in words:
+            owners = self._owners.get(w)
+            if owners is None: continue
+            owners.discard(rule)
+            if not owners:
+                del self._owners[w]
+                self.auto.discard(w)
+        if not any(u == uid for u, _ in self._rules): self._users.discard(uid)
+
+    def rules(self, uid: int) -> dict[str, set[str]]:
+        return {s: p for (u, s), p in self._rules.items() if u == uid}
+
+    def match(self, text: str) -> set[tuple[int, str]]:
+        """Rules hit by text; empty and free when nobody has filters."""
+        if not self._rules: return set()
+        return {rule for w in self.auto.search(text) for rule in self._owners.get(w, ())}
+
+    def recipients(self, sym: str, watchers, hits: set[tuple[int, str]]) -> list[int]:
+        if not self._users: return list(watchers)
+        rules = self._rules
+        return [u for u in watchers if u not in self._users
+                or not ((u, sym) in rules or (u, "*") in rules)
+                or (u, sym) in hits or (u, "*") in hits]
+
+FILTERS = FilterBook()
+
+class SeenFilings:
+    """Delivered filing ids, persisted in seen_filings with an LRU in front."""
+
+    def __init__(self, cap=SEEN_CACHE):
+        self.cap = cap
+        self._lru: OrderedDict[str, None] = OrderedDict()
+
+    async def warm(self):
+        for (fid,) in await STORE.read("SELECT id FROM seen_filings ORDER BY seen_at DESC LIMIT ?", (self.cap,)):
+            self._lru[fid] = None
+        self._lru = OrderedDict(reversed(self._lru.items()))   # oldest first
+
+    def remember(self, ids):
+        for fid in ids:
+            self._lru[fid] = None
+            self._lru.move_to_end(fid)
+        while len(self._lru) > self.cap:
+            self._lru.popitem(last=False)
+
+    async def unseen(self, rows: list) -> list:
+        """Rows whose id is neither cached nor persisted; keeps feed order, drops repeats."""
+        cand = {}
+        for row in rows:
+            cand.setdefault(str(row["id"]), row)
+        known = await self.known(cand)
+        return [row for fid, row in cand.items() if fid not in known]
+
+    async def known(self, ids) -> set[str]:
+        """The ids that are cached or persisted."""
+        known, miss = set(), []
+        for fid in dict.fromkeys(ids):
+            if fid in self._lru:
+                self._lru.move_to_end(fid)
+                known.add(fid)
+            else: miss.append(fid)
+        found = set()
+        for i in range(0, len(miss), 500):
+            chunk = miss[i:i+500]
+            found.update(r[0] for r in await STORE.read(
+                f"SELECT id FROM seen_filings WHERE id IN ({','.join('?'*len(chunk))})", chunk))
+        self.remember(found)
+        return known | found
+
+    def mark(self, db, ids):
+        """Call from the STORE.tx job that enqueues the filings; remember() after commit."""
+        now = time.time()
+        db.executemany("INSERT OR IGNORE INTO seen_filings(id,seen_at) VALUES(?,?)",
+                       [(fid, now) for fid in ids])
+
+    async def prune(self):
+        await STORE.write("DELETE FROM seen_filings WHERE seen_at < ?",
+                          (time.time() - SEEN_KEEP_DAYS * 86400,))
+
+SEEN = SeenFilings()
+
+def _hhmm_range(spec: str) -> tuple[dtime, dtime]:
+    a, b = spec.split("-")
+    return dtime.fromisoformat(a.strip()), dtime.fromisoformat(b.strip())
+
+def _holidays(spec: str) -> set[date]:
+    if spec and os.path.isfile(spec):
+        with open(spec) as f: spec = f.read().replace("\n", ",")
+    return {date.fromisoformat(d.strip()) for d in spec.split(",") if d.strip() and not d.strip().startswith("#")}
+
+class PollCadence:
+    """Filings poll interval. Polls that find fresh rows halve it (down to `lo`), quiet
+    ones stretch it 1.5x up to a ceiling set by the exchange calendar: tight in market
+    hours, looser around them on trading days, `hi` at night, weekends and holidays.
+    HTTP 403/429 doubles it regardless and holds it there until a clean poll."""
+
+    def __init__(self, tz=NSE_TZ, session=NSE_SESSION, active=NSE_ACTIVE, holidays=NSE_HOLIDAYS,
+                 base=POLL_SEC, lo=POLL_MIN, hi=POLL_MAX):
+        self.tz = ZoneInfo(tz)
+        self.session, self.active = _hhmm_range(session), _hhmm_range(active)
+        self.holidays = _holidays(holidays)
+        self.base, self.lo, self.hi = base, min(lo, base), max(hi, base)
+        self.interval, self.wait = float(base), 0.0
+        self.throttled = False
+        self._last, self._phase = 0.0, None
+        self.stats = {"polls": 0, "fresh": 0, "throttled": 0}
+
+    def phase(self, now: datetime) -> str:
+        if now.weekday() >= 5 or now.date() in self.holidays: return "closed"
+        t = now.time()
+        if self.session[0] <= t < self.session[1]: return "session"
+        return "active" if self.active[0] <= t < self.active[1] else "closed"
+
+    def ceiling(self, phase: str) -> float:
+        return min(self.hi, {"session": 4 * self.base, "active": 20 * self.base}.get(phase, self.hi))
+
+    def due(self) -> bool:
+        ph = self.phase(datetime.now(self.tz))
+        if ph != self._phase:
+            log.info("filings poll: %s -> %s, ceiling %.0fs", self._phase, ph, self.ceiling(ph))
+            self._phase = ph
+        elapsed = time.monotonic() - self._last
+        # a long overnight interval must not carry into the open
+        return elapsed >= self.wait or (not self.throttled and elapsed >= self.ceiling(ph))
+
+    def record(self, fresh: int, status=None):
+        cap = self.ceiling(self.phase(datetime.now(self.tz)))
+        st = self.stats
+        st["polls"] += 1
+        self.throttled = status in (403, 429)
+        if self.throttled:
+            st["throttled"] += 1
+            self.interval = min(self.hi, max(self.interval, self.base) * 2)
+        elif fresh:
+            st["fresh"] += 1
+            self.interval = min(cap, max(self.lo, self.interval / 2))
+        else:
+            self.interval = min(cap, self.interval * 1.5)
+        self._last = time.monotonic()
+        self.wait = self.interval * random.uniform(0.9, 1.1)
+
+    def summary(self) -> str:
+        st = self.stats
+        return (f"phase={self._phase} interval={self.interval:.0f}s polls={st['polls']} "
+                f"fresh={st['fresh']} throttled={st['throttled']}")
+
+CADENCE = PollCadence()
+
+async def poll_filings(app):
+    """Ticks every POLL_MIN seconds; polls NSE only when the cadence says so."""
+    if not CADENCE.due(): return
+    fresh, status = 0, {"poll": "error"}
+    try:
+        data, status = await INGEST.poll()
+        fresh = await dispatch_filings(app, data)
+    finally:   # a failed poll still counts, as a quiet one, so failures back off too
+        CADENCE.record(fresh, INGEST.worst(status))
+    # the downtime gap only closes once every NSE segment answered
+    nse = [st for name, st in status.items() if name.startswith("nse:")]
+    if nse and all(st in (200, 304) for st in nse) and CATCHUP.done:
+        await STORE.write("INSERT OR REPLACE INTO poll_state(feed,polled_at) VALUES('nse',?)", (time.time(),))
+
+async def dispatch_filings(app, data: Optional[list]) -> int:
+    if data is None: return 0    # payload identical to the last poll
+    try:
+        return await dispatch_rows(app, data)
+    except Exception:
+        INGEST.forget()    # so the next poll re-reads this payload instead of skipping it
+        raise
+
+async def dispatch_rows(app, rows: list) -> int:
+    """Queue alerts for filing records not delivered before, from any source; returns
+    how many were new. A record is dropped if its own id is seen, or if CROSS finds
+    the same filing already delivered from another exchange."""
+    fresh = await SEEN.unseen(rows)
+    keep = []
+    for r in fresh:
+        if CROSS.duplicate(r, keep): continue
+        keep.append(r)
+    fresh = keep
     if fresh:
-        dispatch_filings._last = fresh[0]["id"]
-        watch_map={}
-        for u,s in DB.execute("SELECT user,symbol FROM watch"):
-            watch_map.setdefault(s, []).append(u)
+        ids, items = [r["id"] for r in fresh], []
         for row in fresh:
-            sym = row["symbol"].upper()
+            sym = row["symbol"]
             hl  = row["headline"]
-            for uid in watch_map.get(sym, []):
-                txt = f"🔔 <b>{sym}</b>\n{html.escape(hl)}"
-                await app.bot.send_message(uid, txt, parse_mode="HTML")
-                DB.execute("INSERT INTO alerts(user,symbol,headline) VALUES(?,?,?)",
-                           (uid, sym, hl))
-        DB.commit()
-
-def check_price_alerts(app):
-    for uid,sym,op,thr in DB.execute("SELECT user,symbol,op,threshold FROM price_alerts"):
-        price = fetch_price(sym)
-        if price is None: continue
-        hit = price>thr if op==">" else price<thr
-        if hit:
-            app.bot.send_message(uid, f"💲 Price alert: {sym} is {price:.2f} {op} {thr}")
-            DB.execute("DELETE FROM price_alerts WHERE user=? AND symbol=? AND op=? AND threshold=?",
-                       (uid,sym,op,thr))
-    DB.commit()
-
-def daily_digest(app):
-    today=date.today().isoformat()
-    rows=DB.execute("SELECT symbol,headline FROM alerts WHERE user=? AND date(ts)=?",
-                    (0, today)).fetchall()  # 0 for broadcast, or loop users
-    # For simplicity, broadcast to user 0 if used; skip implementation
+            src = "" if row["source"] == "nse:equities" else f" <i>{row['source'].upper()}</i>"
+            txt = f"🔔 <b>{sym}</b>{src}\n{html.escape(hl)}"
+            hits = FILTERS.match(f"{row['subject'] or ''}\n{hl}")
+            items += [(f"filing:{row['id']}:{uid}", uid, txt, "HTML", sym, hl)
+                      for uid in FILTERS.recipients(sym, SUBS.watchers(sym), hits)]
+
+        def commit(db):   # filings are marked seen and every recipient queued, or neither
+            enqueue(db, items)
+            SEEN.mark(db, ids)
+        await STORE.tx(commit)
+        SEEN.remember(ids)
+        CROSS.add(fresh)
+        INGEST.delivered(fresh)
+        log.info("filings: %d new; feeds %s", len(fresh), INGEST.summary())
+        app.create_task(drain_outbox(app))
+    return len(fresh)
+
+class CatchUp:
+    """Backfills filings published while the bot was down. NSE pages announcements by
+    date, so the gap since the last good poll is fetched one day per request for every
+    NSE segment being ingested, a few at a time, then fed oldest first through
+    dispatch_rows in paced batches. The live poll
+    keeps running meanwhile; SEEN and outbox keys make the overlap harmless, and the
+    poll time is only advanced once the backfill has finished."""
+
+    def __init__(self, conc=CATCHUP_CONC, batch=CATCHUP_BATCH, pause=CATCHUP_PAUSE):
+        self.conc, self.batch, self.pause = conc, batch, pause
+        self.done = False
+
+    async def since(self) -> Optional[float]:
+        rows = await STORE.read("SELECT polled_at FROM poll_state WHERE feed='nse'")
+        return rows[0][0] if rows else None
+
+    async def _day(self, sem, feed: "NSEFeed", d: date) -> list:
+        ds = d.strftime("%d-%m-%Y")
+        async with sem:   # a failed day raises, so the gap is not marked covered
+            data = await NSE.fetch_json("/api/corporate-announcements",
+                                        {"index": feed.index, "from_date": ds, "to_date": ds}, conditional=False)
+        rows = data.get("data", []) if isinstance(data, dict) else (data or [])
+        return [nse_filing(r, feed.name) for r in rows if r.get("symbol")]
+
+    async def run(self, app, since: Optional[float]):
+        if since is not None:    # None: first start, nothing was missed
+            try:
+                await self._backfill(app, since)
+            except Exception:
+                log.exception("catch-up failed; the gap will be retried on the next start")
+                return
+        self.done = True
+
+    async def _backfill(self, app, since: float):
+        tz = ZoneInfo(NSE_TZ)
+        today = datetime.now(tz).date()
+        first = max(datetime.fromtimestamp(since, tz).date(), today - timedelta(days=SEEN_KEEP_DAYS - 1))
+        days = [first + timedelta(days=i) for i in range((today - first).days + 1)]
+        feeds = [f for f in INGEST.feeds if isinstance(f, NSEFeed)]
+        sem = asyncio.Semaphore(self.conc)
+        pages = await asyncio.gather(*(self._day(sem, f, d) for f in feeds for d in days))
+        rows = sorted((r for page in pages for r in page), key=lambda r: r["filed_at"])
+        sent = 0
+        for i in range(0, len(rows), self.batch):
+            if i: await asyncio.sleep(self.pause)
+            sent += await dispatch_rows(app, rows[i:i + self.batch])
+        log.info("catch-up: %d day(s) x %d segment(s) since %s, %d rows, %d new filings",
+                 len(days), len(feeds), datetime.fromtimestamp(since, tz).isoformat(timespec="minutes"), len(rows), sent)
+
+CATCHUP = CatchUp()
+
+class AlertBook:
+    """Price alerts per symbol as two sorted ladders, like an order book. ">" entries
+    fire once price rises past them, "<" entries once it falls below, so a price
+    update finds every hit with one bisect per side: O(log n + hits)."""
+
+    def __init__(self):
+        self._above: dict[str, list[tuple[float, int, int]]] = {}   # (threshold, id, user)
+        self._below: dict[str, list[tuple[float, int, int]]] = {}
+
+    async def load(self):
+        self._above, self._below = {}, {}
+        rows = await STORE.read("SELECT id,user,symbol,op,threshold FROM price_alerts")
+        for rid, uid, sym, op, thr in sorted(rows, key=lambda r: (r[4], r[0])):
+            (self._above if op == ">" else self._below).setdefault(sym, []).append((thr, rid, uid))
+        log.info("alert book: %d alerts on %d symbols", len(rows), len(self.symbols()))
+
+    def symbols(self) -> set[str]:
+        return self._above.keys() | self._below.keys()
+
+    def density(self, sym: str, price: Optional[float]) -> tuple[int, float]:
+        """(alerts on sym, relative gap from price to the nearest threshold; 0 if unknown)."""
+        above, below = self._above.get(sym, ()), self._below.get(sym, ())
+        if not price: return len(above) + len(below), 0.0
+        gaps = []
+        if above: gaps.append(abs(above[0][0] - price))
+        if below: gaps.append(abs(price - below[-1][0]))
+        return len(above) + len(below), (min(gaps) / price if gaps else 1.0)
+
+    def add(self, rid: int, uid: int, sym: str, op: str, thr: float):
+        insort((self._above if op == ">" else self._below).setdefault(sym, []), (thr, rid, uid))
+
+    def remove(self, rid: int, sym: str, op: str, thr: float):
+        side = self._above if op == ">" else self._below
+        ladder = side.get(sym)
+        if not ladder: return
+        i = bisect_left(ladder, (thr, rid))
+        if i < len(ladder) and ladder[i][:2] == (thr, rid):
+            del ladder[i]
+            if not ladder: del side[sym]
+
+    def pop_hits(self, sym: str, price: float) -> list[tuple[int, int, str, float]]:
+        """Remove and return (id, user, op, threshold) for every alert `price` triggers."""
+        hits = []
+        above = self._above.get(sym)
+        if above:
+            i = bisect_left(above, (price,))            # thresholds strictly below price
+            hits += [(rid, uid, ">", thr) for thr, rid, uid in above[:i]]
+            del above[:i]
+            if not above: del self._above[sym]
+        below = self._below.get(sym)
+        if below:
+            i = bisect_right(below, (price, float("inf")))   # strictly above price
+            hits += [(rid, uid, "<", thr) for thr, rid, uid in below[i:]]
+            del below[i:]
+            if not below: del self._below[sym]
+        return hits
+
+BOOK = AlertBook()
+
+async def fire_price_alerts(app, prices: dict[str, float]):
+    """Evaluate fresh prices against BOOK and queue every triggered alert."""
+    hits = []
+    for sym, price in prices.items():
+        hits += [(sym, price, h) for h in BOOK.pop_hits(sym, price)]
+    if not hits: return
+
+    def fire(db):   # a triggered alert is removed and its message queued atomically;
+        # one the user deleted meanwhile is skipped
+        enqueue(db, [(f"price:{rid}:{uid}:{sym}{op}{thr}", uid,
+                      f"💲 Price alert: {sym} is {price:.2f} {op} {thr}", None, None, None)
+                     for sym, price, (rid, uid, op, thr) in hits
+                     if db.execute("DELETE FROM price_alerts WHERE id=?", (rid,)).rowcount])
+    try:
+        await STORE.tx(fire)
+    except Exception:
+        for sym, _, (rid, uid, op, thr) in hits:   # keep them armed for the next price
+            BOOK.add(rid, uid, sym, op, thr)
+        raise
+    app.create_task(drain_outbox(app))
+
+async def check_price_alerts(app):
+    syms = BOOK.symbols()
+    if STREAM and STREAM.connected:
+        syms -= STREAM.live(QUOTE_TTL)   # those are evaluated tick by tick; poll the rest
+    due = QUOTA.pick(syms)
+    if not due: return
+    prices = await QUOTE_CACHE.get_many(due, fresh=True)
+    QUOTA.fetched(due)
+    log.info("price check: %d/%d symbols due, %d quotes; cache %s; providers %s",
+             len(due), len(syms), len(prices), QUOTE_CACHE.summary(), QUOTE_SOURCE.summary())
+    await fire_price_alerts(app, prices)
+
+# Streaming quotes: while a feed is connected its symbols are evaluated on every
+# tick; check_price_alerts keeps polling anything the feed does not cover or has
+# not ticked recently, which is everything while it is down.
+
+class PriceStream(ABC):
+    """A push quote feed. Subclasses implement _session(), which connects,
+    subscribes to `wanted` and calls _emit() per tick until the feed drops;
+    _run() reconnects with jittered backoff."""
+
+    def __init__(self):
+        self.wanted: set[str] = set()
+        self.subscribed: set[str] = set()
+        self.connected = False
+        self.ticks = self.drops = 0
+        self.last_tick: dict[str, float] = {}   # symbol -> monotonic time of its last tick
+        self._on_tick = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, on_tick):
+        self._on_tick = on_tick
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError): await self._task
+
+    async def set_symbols(self, syms):
+        self.wanted = set(syms)
+        if self.connected: await self._resubscribe()
+
+    async def _resubscribe(self):
+        self.subscribed = set(self.wanted)
+
+    def live(self, max_age: float) -> set[str]:
+        """Subscribed symbols that ticked within max_age seconds; illiquid or uncovered ones are not."""
+        now = time.monotonic()
+        return {s for s in self.subscribed if now - self.last_tick.get(s, -max_age) < max_age}
+
+    def _emit(self, sym: str, price: float):
+        self.ticks += 1
+        self.last_tick[sym] = time.monotonic()
+        self._on_tick(sym, price)
+
+    @abstractmethod
+    async def _session(self): ...
+
+    async def _run(self):
+        delay = 1.0
+        while True:
+            t0 = time.monotonic()
+            try:
+                await self._session()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("%s dropped: %r; polling covers its symbols", type(self).__name__, e)
+            self.connected, self.subscribed = False, set()
+            self.drops += 1
+            delay = 1.0 if time.monotonic() - t0 > 60 else min(delay * 2, 60)
+            await asyncio.sleep(random.uniform(0.5, 1) * delay)
+
+class WebSocketStream(PriceStream):
+    """JSON websocket feed: sends {"action": "subscribe"|"unsubscribe", "symbols": [...]},
+    receives {"symbol": ..., "price": ...} objects (or lists of them)."""
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url
+        self._ws = None
+
+    async def _resubscribe(self):
+        add, drop = self.wanted - self.subscribed, self.subscribed - self.wanted
+        self.subscribed = set(self.wanted)
+        if add:  await self._ws.send_json({"action": "subscribe", "symbols": sorted(add)})
+        if drop: await self._ws.send_json({"action": "unsubscribe", "symbols": sorted(drop)})
+
+    async def _session(self):
+        async with aiohttp.ClientSession() as sess:
+            async with sess.ws_connect(self.url, heartbeat=20) as ws:
+                self._ws, self.connected = ws, True
+                log.info("price stream connected: %s", self.url)
+                await self._resubscribe()
+                async for msg in ws:
+                    if msg.type != aiohttp.WSMsgType.TEXT: break
+                    data = json.loads(msg.data)
+                    for t in data if isinstance(data, list) else [data]:
+                        try: sym, price = t["symbol"].upper(), float(t["price"])
+                        except (KeyError, TypeError, ValueError, AttributeError): continue
+                        if sym in self.subscribed: self._emit(sym, price)
+        self._ws = None
+        raise ConnectionError("websocket closed")
+
+class ReplayStream(PriceStream):
+    """Local stand-in for a live feed: plays an NDJSON file of {"t", "symbol", "price"}
+    ticks at `speed`x their recorded pacing (0 = as fast as possible)."""
+
+    def __init__(self, path: str, speed: float = 1.0):
+        super().__init__()
+        self.path, self.speed = path, speed
+
+    async def _session(self):
+        self.connected = True
+        await self._resubscribe()
+        prev = None
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip(): continue
+                t = json.loads(line)
+                if self.speed and prev is not None and "t" in t:
+                    await asyncio.sleep(max(0.0, (t["t"] - prev) / self.speed))
+                prev = t.get("t", prev)
+                sym = t["symbol"].upper()
+                if sym in self.subscribed: self._emit(sym, float(t["price"]))
+                await asyncio.sleep(0)
+        raise EOFError(f"replay of {self.path} finished")
+
+def make_stream(spec: str) -> Optional[PriceStream]:
+    if spec.startswith(("ws://", "wss://")):
+        return WebSocketStream(spec)
+    if spec.startswith("replay:"):
+        path, _, speed = spec[len("replay:"):].partition("@")
+        return ReplayStream(path, float(speed or 1))
+    return None
+
+STREAM = make_stream(QUOTE_STREAM)
+
+def stream_ticks(app):
+    """Tick callback: keeps the latest price per symbol and evaluates them in small batches."""
+    pending: dict[str, float] = {}
+    task: Optional[asyncio.Task] = None
+
+    async def flush():
+        while pending:
+            await asyncio.sleep(STREAM_FLUSH_SEC)
+            batch = dict(pending)
+            pending.clear()
+            try: await fire_price_alerts(app, batch)
+            except Exception: log.exception("stream tick evaluation failed")
+
+    def on_tick(sym: str, price: float):
+        nonlocal task
+        QUOTE_CACHE.put(sym, price)
+        pending[sym] = price
+        if task is None or task.done():
+            task = asyncio.get_running_loop().create_task(flush())
+    return on_tick
+
+async def sync_stream():
+    """Keep the feed subscribed to exactly the symbols that have live alerts."""
+    await STREAM.set_symbols(BOOK.symbols())
+
+def _archive_chunk(rows):
+    """Append raw rows to archive/alerts-<day>.ndjson.gz (one gzip member per call)."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    by_day = {}
+    for _, u, sym, hl, ts in rows:
+        by_day.setdefault(ts[:10], []).append(json.dumps({"user": u, "symbol": sym, "headline": hl, "ts": ts}))
+    for day, lines in by_day.items():
+        with gzip.open(os.path.join(ARCHIVE_DIR, f"alerts-{day}.ndjson.gz"), "at", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+async def archive_alerts(keep_days=ALERT_KEEP_DAYS):
+    """Move alerts older than keep_days to gzip'd NDJSON plus per-user/day/symbol counts,
+    a chunk at a time so no single transaction holds the write lock for long.
+    Rows are archived before they are deleted: a crash in between can repeat
+    archive lines on the next run, but never loses a row or double-counts it."""
+    cutoff = (date.today() - timedelta(days=keep_days)).isoformat()
+    last, moved = 0, 0
+    while True:
+        page = await STORE.read("SELECT rowid,user,symbol,headline,ts FROM alerts "
+                                "WHERE rowid>? ORDER BY rowid LIMIT ?", (last, ARCHIVE_CHUNK))
+        # rows arrive in ts order (rowid tracks insertion), so stop at the first recent one
+        rows = []
+        for r in page:
+            if r[4] >= cutoff: break
+            rows.append(r)
+        if not rows: break
+        last = rows[-1][0]
+        await asyncio.to_thread(_archive_chunk, rows)
+        counts = {}
+        for _, u, sym, _, ts in rows:
+            counts[(u, ts[:10], sym)] = counts.get((u, ts[:10], sym), 0) + 1
+
+        def roll(db):
+            db.executemany("INSERT INTO alerts_daily(user,day,symbol,n) VALUES(?,?,?,?) "
+                           "ON CONFLICT(user,day,symbol) DO UPDATE SET n=n+excluded.n",
+                           [(*k, n) for k, n in counts.items()])
+            db.executemany("DELETE FROM alerts WHERE rowid=?", [(r[0],) for r in rows])
+        await STORE.tx(roll)
+        moved += len(rows)
+        if len(rows) < len(page): break
+    if moved:
+        log.info("archived %d alert rows older than %s to %s", moved, cutoff, ARCHIVE_DIR)
+
+def render_digest(day: str, rows) -> str:
+    """rows: (symbol, headline) in time order -> one HTML message, grouped by symbol."""
+    by_sym = {}
+    for sym, hl in rows:
+        by_sym.setdefault(sym, []).append(hl)
+    parts = [f"📨 <b>Daily digest — {day}</b>"]
+    for sym, hls in by_sym.items():
+        parts.append(f"\n<b>{sym}</b>")
+        parts += [f"• {html.escape(h)}" for h in hls]
+    text = "\n".join(parts)
+    if len(text) > DIGEST_MAX_CHARS:
+        text = text[:DIGEST_MAX_CHARS].rsplit("\n", 1)[0] + "\n…"
+    return text
+
+class DigestScheduler:
+    """Per-user digests off a heap keyed by due time. A user's slot is their preferred
+    local time plus a fixed per-user offset inside DIGEST_WINDOW, so a cohort sharing
+    a time is released gradually. Outbox keys digest:<local day>:<user> make a
+    re-queued slot (restart, preference change) a no-op."""
+
+    def __init__(self, window=DIGEST_WINDOW):
+        self.window = window
+        self._heap: list[tuple[float, int, date]] = []
+        self._due: dict[int, float] = {}             # live entry per user; others are stale
+        self._prefs: dict[int, tuple[str, str]] = {}  # user -> (tz, "HH:MM")
+
+    def _offset(self, uid: int) -> float:
+        return (uid * 2654435761 % 2**32) / 2**32 * self.window
+
+    def pref(self, uid: int) -> tuple[ZoneInfo, str]:
+        tz, at = self._prefs.get(uid, (DIGEST_TZ, DIGEST_AT))
+        return ZoneInfo(tz), at
+
+    def schedule(self, uid: int, after: float):
+        tz, at = self.pref(uid)
+        hh, mm = map(int, at.split(":"))
+        today = datetime.fromtimestamp(after, tz).date()
+        for d in (today - timedelta(days=1), today, today + timedelta(days=1)):
+            due = datetime.combine(d, dtime(hh, mm), tz).timestamp() + self._offset(uid)
+            if due > after: break
+        self._due[uid] = due
+        heapq.heappush(self._heap, (due, uid, d))
+
+    async def load(self):
+        self._prefs = {u: (tz or DIGEST_TZ, at or DIGEST_AT)
+                       for u, tz, at in await STORE.read("SELECT user,tz,digest_at FROM user_prefs")}
+        self._heap, self._due = [], {}
+        since = time.time() - DIGEST_GRACE
+        for uid in SUBS.users() | set(self._prefs):
+            self.schedule(uid, since)
+        log.info("digest scheduler: %d users", len(self._due))
+
+    def ensure(self, uid: int):
+        if uid not in self._due: self.schedule(uid, time.time())
+
+    async def set_pref(self, uid: int, tz: str, at: str):
+        await STORE.write("INSERT INTO user_prefs(user,tz,digest_at) VALUES(?,?,?) "
+                          "ON CONFLICT(user) DO UPDATE SET tz=excluded.tz, digest_at=excluded.digest_at",
+                          (uid, tz, at))
+        self._prefs[uid] = (tz, at)
+        self.schedule(uid, time.time())
+
+    async def pump(self, app):
+        """Release every slot that is due: one alerts query per (tz, day) group and chunk."""
+        now, groups = time.time(), {}
+        while self._heap and self._heap[0][0] <= now:
+            due, uid, d = heapq.heappop(self._heap)
+            if self._due.get(uid) != due: continue
+            groups.setdefault((self._prefs.get(uid, (DIGEST_TZ,))[0], d), []).append(uid)
+            self.schedule(uid, due)
+        if not groups: return
+        items = []
+        for (tz, d), uids in groups.items():
+            start, end = local_day_range(ZoneInfo(tz), d)
+            for i in range(0, len(uids), DIGEST_CHUNK):
+                chunk = uids[i:i+DIGEST_CHUNK]
+                by_user = {}
+                for u, sym, hl in await STORE.read(
+                        f"SELECT user,symbol,headline FROM alerts WHERE user IN ({','.join('?'*len(chunk))}) "
+                        "AND ts>=? AND ts<? ORDER BY user, ts", (*chunk, start, end)):
+                    by_user.setdefault(u, []).append((sym, hl))
+                items += [(f"digest:{d.isoformat()}:{u}", u, render_digest(d.isoformat(), rows), "HTML", None, None)
+                          for u, rows in by_user.items()]
+        if items:
+            await STORE.tx(lambda db: enqueue(db, items))
+            app.create_task(drain_outbox(app))
+            log.info("digest: queued %d of %d due users", len(items), sum(map(len, groups.values())))
+
+DIGEST = DigestScheduler()
 
 # ──────────────── Main & Scheduler ──────────────── #
 
+async def on_startup(app):
+    STORE.open()
+    await SEEN.warm()
+    await SUBS.load()
+    await DIGEST.load()
+    await BOOK.load()
+    await FILTERS.load()
+    await CROSS.warm()
+    app.create_task(CATCHUP.run(app, await CATCHUP.since()))
+    # jobs run on the bot's own loop; a tick still running when the next one
+    # is due is skipped (max_instances=1) and missed ticks collapse into one
+    sched = AsyncIOScheduler(event_loop=asyncio.get_running_loop(),
+                             job_defaults={"max_instances": 1, "coalesce": True})
+    sched.add_job(poll_filings, 'interval', args=[app], id="filings",
+                  seconds=max(1, CADENCE.lo), next_run_time=datetime.now())
+    sched.add_job(check_price_alerts, 'interval', args=[app], id="prices",
+                  seconds=QUOTA_TICK, next_run_time=datetime.now())
+    if STREAM:
+        STREAM.wanted = BOOK.symbols()
+        STREAM.start(stream_ticks(app))
+        sched.add_job(sync_stream, 'interval', id="stream_sync", seconds=2)
+    # resumes anything left pending by a crash, then retries failed sends
+    sched.add_job(drain_outbox, 'interval', args=[app], id="outbox",
+                  seconds=OUTBOX_SEC, next_run_time=datetime.now())
+    sched.add_job(ALERT_LOG.flush, 'interval', id="alertlog", seconds=ALERT_LOG.interval)
+    sched.add_job(archive_alerts, CronTrigger(hour=3, minute=30), id="archive")
+    sched.add_job(prune_outbox, 'interval', id="outbox_prune", hours=6)
+    sched.add_job(SEEN.prune, 'interval', id="seen_prune", hours=6)
+    sched.add_job(check_subscriptions, 'interval', id="subs_check", hours=1)
+    sched.add_job(DIGEST.pump, 'interval', args=[app], id="digest", seconds=5)
+    sched.start()
+    app.bot_data["sched"] = sched
+
+async def on_shutdown(app):
+    app.bot_data["sched"].shutdown(wait=False)
+    if STREAM:
+        await STREAM.stop()
+        log.info("price stream: %d ticks, %d drops", STREAM.ticks, STREAM.drops)
+    await QUOTES.close()
+    await NSE.close()
+    await INGEST.close()
+    log.info("NSE client: %s; poll cadence: %s", NSE.summary(), CADENCE.summary())
+    await ALERT_LOG.flush()
+    log.info("alert log: %d rows in %d flushes", ALERT_LOG.rows, ALERT_LOG.flushes)
+    await STORE.close()
+    log.info("store: %d writes in %d commits", STORE.jobs, STORE.commits)
+
 def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    if sys.argv[1:2] == ["migrate"]:
+        # python telegram_stock_alert_bot.py migrate [--dry-run]
+        with closing(connect()) as db:
+            migrate(db, dry_run="--dry-run" in sys.argv)
+        return
+    if not BOT_TOKEN:
+        raise RuntimeError("TG_TOKEN env var missing")
+    with closing(connect()) as db:
+        migrate(db)
+    app = (ApplicationBuilder().token(BOT_TOKEN)
+           .post_init(on_startup).post_shutdown(on_shutdown).build())
 
     # commands
     app.add_handler(CommandHandler("menu", cmd_menu))
@@ -252,6 +2375,11 @@ def main():
     app.add_handler(CommandHandler("subscriptionlist", cmd_list))
     app.add_handler(CommandHandler("alertslist", cmd_alertslist))
     app.add_handler(CommandHandler("digest", cmd_digest))
+    app.add_handler(CommandHandler("digesttime", cmd_digesttime))
+    app.add_handler(CommandHandler("filter", cmd_filter))
+    app.add_handler(CommandHandler("unfilter", cmd_unfilter))
+    app.add_handler(CommandHandler("filters", cmd_filters))
+    app.add_handler(CommandHandler("price", cmd_price))
     app.add_handler(CommandHandler("pricealert", cmd_pricealert_text))
     app.add_handler(CommandHandler("view_price_alerts", cmd_view_price_alerts))
 
@@ -260,15 +2388,6 @@ def main():
     app.add_handler(CallbackQueryHandler(cb_done_pa, pattern="^DONE_PA$"))
     app.add_handler(CallbackQueryHandler(cb_menu_router))
 
-    # scheduler
-    sched = BackgroundScheduler()
-    sched.add_job(lambda: asyncio.run(dispatch_filings(app)),
-                  'interval', seconds=POLL_SEC, next_run_time=datetime.now())
-    sched.add_job(lambda: check_price_alerts(app),
-                  'interval', minutes=1, next_run_time=datetime.now())
-    # daily digest trigger left as exercise
-    sched.start()
-
     log.info("Bot starting …")
     app.run_polling()
 
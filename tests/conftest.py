@@ -0,0 +1,36 @@
+import asyncio, os, sys
+from contextlib import closing
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import telegram_stock_alert_bot as bot
+
+
+class FakeApp:
+    """Stands in for the telegram Application: background work is recorded, not run."""
+
+    def __init__(self):
+        self.scheduled = 0
+
+    def create_task(self, coro):
+        self.scheduled += 1
+        coro.close()
+
+
+@pytest.fixture
+def app():
+    return FakeApp()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A migrated watch.db in tmp_path installed as bot.STORE; yields its path."""
+    path = str(tmp_path / "watch.db")
+    with closing(bot.connect(path)) as db:
+        bot.migrate(db)
+    st = bot.Store(path)
+    st.open()
+    monkeypatch.setattr(bot, "STORE", st)
+    yield path
+    asyncio.run(st.close())
@@ -0,0 +1,162 @@
+import asyncio, sqlite3
+from contextlib import closing
+
+import pytest
+
+import telegram_stock_alert_bot as bot
+
+
+@pytest.fixture
+def watched(store, monkeypatch):
+    with closing(sqlite3.connect(store)) as db:
+        db.execute("INSERT INTO watch(user,symbol) VALUES(1,'RELIANCE')")
+        db.commit()
+    monkeypatch.setattr(bot, "SEEN", bot.SeenFilings())
+    monkeypatch.setattr(bot, "SUBS", bot.SubscriptionIndex())
+    monkeypatch.setattr(bot, "FILTERS", bot.FilterBook())
+    monkeypatch.setattr(bot, "CROSS", bot.CrossSourceDedup())
+    monkeypatch.setattr(bot, "INGEST", bot.FilingIngest([bot.NSEFeed("equities"), bot.BSEFeed("")]))
+    asyncio.run(bot.SUBS.load())
+    return store
+
+
+def nse(seq, at, headline):
+    return bot.nse_filing({"seq_id": seq, "symbol": "RELIANCE", "desc": "Press Release",
+                           "attchmntText": headline, "sort_date": f"2026-10-16 {at}:00"})
+
+
+def bse(ref, at, headline):
+    return bot.filing("bse", ref, "RELIANCE", headline, "Press Release",
+                      bot._filed_at(f"2026-10-16T{at}:00", ("%Y-%m-%dT%H:%M:%S",)))
+
+
+def outbox(path):
+    with closing(sqlite3.connect(path)) as db:
+        return [k for (k,) in db.execute("SELECT key FROM outbox ORDER BY key")]
+
+
+def test_same_source_same_category_filings_all_alert(watched, app):
+    rows = [nse(111, "10:00", "Jio launches"), nse(112, "10:10", "Retail update"), nse(113, "10:35", "Q2 call")]
+    assert asyncio.run(bot.dispatch_rows(app, rows)) == 3
+    assert outbox(watched) == ["filing:111:1", "filing:112:1", "filing:113:1"]
+
+
+def test_same_filing_on_another_exchange_alerts_once(watched, app):
+    # how the two exchanges typically word the same filing
+    first = nse(111, "10:14", "Reliance Industries Limited has informed the Exchange about Press Release "
+                              "titled Jio launches True 5G services in Delhi and Mumbai")
+    assert asyncio.run(bot.dispatch_rows(app, [first])) == 1
+    later = [bse("b1", "10:21", "Reliance Industries Ltd - Press Release - Jio Launches True 5G Services In Delhi And Mumbai"),
+             bse("b2", "10:21", "Reliance Industries Ltd - Board Meeting Intimation for Quarterly Results")]
+    assert asyncio.run(bot.dispatch_rows(app, later)) == 1
+    assert outbox(watched) == ["filing:111:1", "filing:bse:b2:1"]
+
+
+def test_bare_category_headlines_are_not_merged(watched, app):
+    rows = [nse(111, "10:14", "Press Release"), bse("b1", "10:16", "Reliance Industries Ltd - Press Release")]
+    assert asyncio.run(bot.dispatch_rows(app, rows)) == 2
+
+
+def test_far_apart_copies_are_separate_filings(watched, app):
+    rows = [nse(111, "10:00", "Jio launches 5G in Delhi"), bse("b1", "11:30", "Jio launches 5G in Delhi")]
+    assert asyncio.run(bot.dispatch_rows(app, rows)) == 2
+
+
+def test_cross_dedup_survives_a_restart(watched, app, monkeypatch):
+    row = bot.filing("nse:equities", 111, "RELIANCE", "Jio launches 5G in Delhi", None, bot.time.time())
+    assert asyncio.run(bot.dispatch_rows(app, [row])) == 1
+    monkeypatch.setattr(bot, "CROSS", bot.CrossSourceDedup())
+    asyncio.run(bot.CROSS.warm())
+    copy = bot.filing("bse", "b1", "RELIANCE", "Reliance Industries Ltd - Jio launches 5G in Delhi", None, bot.time.time())
+    assert asyncio.run(bot.dispatch_rows(app, [copy])) == 0
+
+
+def test_cross_exchange_copies_in_one_batch_alert_once(watched, app):
+    rows = [bse("b1", "10:14", "Jio launches 5G in Delhi"), nse(111, "10:16", "Jio launches 5G in Delhi")]
+    assert asyncio.run(bot.dispatch_rows(app, rows)) == 1
+    assert asyncio.run(bot.dispatch_rows(app, rows)) == 0
+    assert outbox(watched) == ["filing:bse:b1:1"]
+
+
+def test_repeated_id_is_dropped(watched, app):
+    assert asyncio.run(bot.dispatch_rows(app, [nse(111, "10:00", "Jio launches")])) == 1
+    assert asyncio.run(bot.dispatch_rows(app, [nse(111, "10:00", "Jio launches")])) == 0
+
+
+class StubFeed(bot.FilingFeed):
+    def __init__(self, name, result):
+        self.name, self.result = name, result
+
+    async def fetch(self):
+        if isinstance(self.result, Exception): raise self.result
+        return self.result
+
+
+def test_throttled_segment_backs_off_and_keeps_the_gap_open(watched, app, monkeypatch):
+    monkeypatch.setattr(bot, "INGEST", bot.FilingIngest([
+        StubFeed("nse:equities", bot.FeedError(403)), StubFeed("nse:sme", []), StubFeed("nse:debt", None)]))
+    monkeypatch.setattr(bot, "CADENCE", bot.PollCadence(holidays=""))
+    monkeypatch.setattr(bot.CATCHUP, "done", True)
+    data, status = asyncio.run(bot.INGEST.poll())
+    assert data == [] and status == {"nse:equities": 403, "nse:sme": 200, "nse:debt": 304}
+    assert bot.FilingIngest.worst(status) == 403
+
+    asyncio.run(bot.poll_filings(app))
+    assert bot.CADENCE.throttled
+    with closing(sqlite3.connect(watched)) as db:
+        assert db.execute("SELECT count(*) FROM poll_state").fetchone()[0] == 0
+
+
+def test_nse_request_failure_raises_from_the_feed(monkeypatch):
+    async def forbidden(path, params, conditional=True): raise bot.FeedError(403)
+    monkeypatch.setattr(bot.NSE, "fetch_json", forbidden)
+    with pytest.raises(bot.FeedError):
+        asyncio.run(bot.NSEFeed("equities").fetch())
+
+
+def test_failed_polls_back_off(watched, app, monkeypatch):
+    async def broken(): raise RuntimeError("disk full")
+    monkeypatch.setattr(bot, "CADENCE", bot.PollCadence(holidays=""))
+    monkeypatch.setattr(bot.INGEST, "poll", broken)
+    waits = []
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            asyncio.run(bot.poll_filings(app))
+        assert not bot.CADENCE.due()
+        waits.append(bot.CADENCE.interval)
+        bot.CADENCE._last -= bot.CADENCE.wait   # let the wait elapse
+    assert waits[0] < waits[1] < waits[2]
+
+
+def test_catch_up_backfills_every_nse_segment(watched, app, monkeypatch):
+    asked = []
+
+    async def page(path, params, conditional=True):
+        asked.append((params["index"], params["from_date"]))
+        return {"data": [{"seq_id": f"{params['index']}-{params['from_date']}", "symbol": "RELIANCE",
+                          "attchmntText": f"{params['index']} filing", "sort_date": "2026-10-16 10:00:00"}]}
+
+    monkeypatch.setattr(bot.NSE, "fetch_json", page)
+    monkeypatch.setattr(bot, "INGEST", bot.FilingIngest([bot.NSEFeed("equities"), bot.NSEFeed("sme"), bot.BSEFeed("")]))
+    catchup = bot.CatchUp(pause=0)
+    asyncio.run(catchup.run(app, bot.time.time() - 86400))
+    assert catchup.done
+    assert {i for i, _ in asked} == {"equities", "sme"} and len(asked) == 4
+    keys = outbox(watched)
+    assert len(keys) == 4 and sum(k.startswith("filing:nse:sme:") for k in keys) == 2
+
+
+def test_bse_rows_without_an_id_are_skipped(monkeypatch):
+    body = {"Table": [{"NEWSID": None, "SCRIP_CD": 500325, "HEADLINE": "a"},
+                      {"NEWSID": "n1", "SCRIP_CD": 500325, "HEADLINE": "b", "NEWS_DT": "2026-10-16T10:00:00"}]}
+
+    class Resp:
+        status = 200
+        async def read(self): return bot.json.dumps(body).encode()
+        async def __aenter__(self): return self
+        async def __aexit__(self, *exc): pass
+
+    feed = bot.BSEFeed("500325,RELIANCE")
+    monkeypatch.setattr(feed, "_session", lambda: type("S", (), {"get": lambda self, url, params: Resp()})())
+    rows = asyncio.run(feed.fetch())
+    assert [(r["id"], r["symbol"]) for r in rows] == [("bse:n1", "RELIANCE")]
@@ -0,0 +1,107 @@
+import asyncio, random, re
+
+import pytest
+
+import telegram_stock_alert_bot as bot
+
+
+def naive(words, text):
+    text = text.lower()
+    return {w for w in words
+            for m in re.finditer(f"(?={re.escape(w)})", text) if m.start() == 0 or not text[m.start() - 1].isalnum()}
+
+
+def test_automaton_matches_naive_search_under_churn():
+    rng = random.Random(7)
+    auto, live = bot.KeywordAutomaton(), {}
+    for step in range(3000):
+        w = "".join(rng.choice("abc") for _ in range(rng.randint(1, 4)))
+        if rng.random() < 0.6:
+            auto.add(w)
+            live[w] = live.get(w, 0) + 1
+        elif live.get(w):
+            auto.discard(w)
+            live[w] -= 1
+            if not live[w]: del live[w]
+        if step % 25 == 0:
+            text = "".join(rng.choice("abc -") for _ in range(40))
+            assert auto.search(text) == naive(live, text)
+    assert len(auto) == len(live)
+
+
+def test_refcounted_discard_readd_and_compaction():
+    auto = bot.KeywordAutomaton()
+    auto.add("dividend"); auto.add("dividend"); auto.add("bonus")
+    auto.discard("dividend")
+    assert auto.search("Interim dividend and bonus") == {"dividend", "bonus"}
+    auto.discard("dividend")
+    assert auto.search("Interim dividend and bonus") == {"bonus"}
+    nodes = len(auto._goto)
+    auto.add("dividend")    # re-added: the dead path is reused, nothing new is built
+    assert len(auto._goto) == nodes and auto.search("dividend") == {"dividend"}
+
+    for w in ("split", "buyback", "merger"): auto.add(w)
+    for w in ("split", "buyback"): auto.discard(w)
+    assert len(auto._goto) > nodes        # dead words still occupy the trie ...
+    auto.discard("merger")                # ... until they outnumber the live ones
+    assert len(auto._goto) == 1 + len("dividend") + len("bonus")
+    assert auto.search("bonus split merger dividend") == {"dividend", "bonus"}
+
+
+def test_keywords_match_at_word_starts_only():
+    auto = bot.KeywordAutomaton()
+    for w in ("result", "order", "agm"): auto.add(w)
+    assert auto.search("Financial Results for Q2") == {"result"}
+    assert auto.search("Disorder; the AGM-notice") == {"agm"}
+    assert auto.search("bagm ordering") == {"order"}
+
+
+@pytest.fixture
+def book():
+    fb = bot.FilterBook()
+    fb.add(1, "TCS", ["#results"])
+    fb.add(2, "*", ["dividend"])
+    fb.add(3, "INFY", ["buyback"])
+    fb.add(4, "TCS", ["order win"])
+    fb.add(4, "*", ["dividend"])
+    return fb
+
+
+def test_recipients_follow_per_symbol_and_wildcard_rules(book):
+    watchers = [1, 2, 3, 4, 5]
+    hits = book.match("Outcome of Board Meeting\nFinancial Results and interim Dividend")
+    assert book.recipients("TCS", watchers, hits) == [1, 2, 3, 4, 5]
+    hits = book.match("Updates\nChange in Key Managerial Personnel")
+    # 3 filters only INFY and 5 has no rules; 1, 2 and 4 filter TCS directly or via *
+    assert book.recipients("TCS", watchers, hits) == [3, 5]
+    hits = book.match("Updates\nTCS bags order win from a UK bank")
+    assert book.recipients("TCS", watchers, hits) == [3, 4, 5]
+    assert book.recipients("WIPRO", watchers, book.match("Order win")) == [1, 3, 5]
+
+
+def test_clearing_rules_restores_everything_and_drops_unused_keywords(book):
+    book.clear(1, "TCS")
+    book.clear(4, "TCS")
+    assert book.recipients("TCS", [1, 4], book.match("Change in KMP")) == [1]
+    assert "order win" not in book._owners and "financial result" not in book._owners
+    assert book.rules(4) == {"*": {"dividend"}}
+    book.clear(4, "*")
+    assert book.recipients("TCS", [4], set()) == [4]
+
+
+def test_filters_persist_and_reload(store, monkeypatch):
+    monkeypatch.setattr(bot, "FILTERS", bot.FilterBook())
+
+    class Msg:
+        async def reply_text(self, text, **kw): self.text = text
+
+    class Update:
+        class effective_user: id = 9
+        message = Msg()
+
+    class Ctx:
+        args = ["tcs", "#dividend,", "order", "win"]
+
+    asyncio.run(bot.cmd_filter(Update, Ctx))
+    asyncio.run(bot.FILTERS.load())
+    assert bot.FILTERS.rules(9) == {"TCS": {"#dividend", "order win"}}
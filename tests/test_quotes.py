@@ -0,0 +1,122 @@
+import asyncio, sqlite3, time
+from contextlib import closing
+
+import pytest
+
+import telegram_stock_alert_bot as bot
+
+
+@pytest.fixture
+def quotes_db(tmp_path):
+    path = str(tmp_path / "quotes.db")
+    with closing(sqlite3.connect(path)) as db:
+        db.execute("CREATE TABLE quotes(symbol TEXT, price REAL)")
+        db.executemany("INSERT INTO quotes VALUES(?,?)", [("TCS", 3500.0), ("infy", 1500.0)])
+        db.commit()
+    return path
+
+
+class Slow(bot.QuoteProvider):
+    name = "slow"
+
+    def __init__(self, delay):
+        self.delay, self.calls = delay, 0
+
+    async def prices(self, syms):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {s: 1.0 for s in syms}
+
+
+class Flaky(bot.QuoteProvider):
+    def __init__(self, name, ok=False):
+        self.name, self.ok, self.calls = name, ok, 0
+
+    async def prices(self, syms):
+        self.calls += 1
+        if not self.ok: raise RuntimeError("down")
+        return {s: 2.0 for s in syms}
+
+
+def test_sqlite_provider_reads_known_symbols(quotes_db):
+    got = asyncio.run(bot.SQLiteQuoteProvider(quotes_db).prices(["TCS", "INFY", "WIPRO"]))
+    assert got == {"TCS": 3500.0, "INFY": 1500.0}
+
+
+def test_slow_primary_is_hedged(quotes_db):
+    slow, local = Slow(5), bot.SQLiteQuoteProvider(quotes_db)
+    src = bot.QuoteSource([slow, local], hedge_after=0.05)
+    t0 = time.monotonic()
+    assert asyncio.run(src.prices(["TCS"])) == {"TCS": 3500.0}
+    assert time.monotonic() - t0 < 1
+    assert src.hedges == 1
+    # the cancelled loser is neither a failure nor left holding anything
+    assert src.health["slow"].errors == 0 and src.breakers["slow"].state == "closed"
+
+
+def test_missing_symbols_fall_through_to_next_provider(quotes_db):
+    class Partial(bot.QuoteProvider):
+        name = "partial"
+        async def prices(self, syms): return {"WIPRO": 400.0} if "WIPRO" in syms else {}
+
+    src = bot.QuoteSource([Partial(), bot.SQLiteQuoteProvider(quotes_db)], hedge_after=1)
+    assert asyncio.run(src.prices(["TCS", "WIPRO"])) == {"TCS": 3500.0, "WIPRO": 400.0}
+
+
+def test_breaker_opens_and_stops_calling():
+    bad = Flaky("bad")
+    src = bot.QuoteSource([bad], hedge_after=1)
+    src.breakers["bad"].cooldown = 60
+    for _ in range(5):
+        assert asyncio.run(src.prices(["TCS"])) == {}
+    assert bad.calls == src.breakers["bad"].threshold
+    assert src.breakers["bad"].state == "open"
+
+
+def test_unreached_half_open_provider_keeps_its_trial():
+    primary, backup = Flaky("primary", ok=True), Flaky("backup")
+    src = bot.QuoteSource([primary, backup], hedge_after=1)
+    br = src.breakers["backup"]
+    for _ in range(br.threshold): br.failure()
+    br.cooldown = 0
+    for _ in range(3):   # the primary answers; the half-open backup is never started
+        assert asyncio.run(src.prices(["TCS"])) == {"TCS": 2.0}
+    assert br.state == "half-open" and br.available()
+    primary.ok, backup.ok = False, True
+    assert asyncio.run(src.prices(["TCS"])) == {"TCS": 2.0}
+    assert backup.calls == 1 and br.state == "closed"
+
+
+def test_cancelled_refresh_releases_waiters():
+    async def run():
+        started = asyncio.Event()
+
+        async def hang(syms):
+            started.set()
+            await asyncio.sleep(60)
+
+        cache = bot.QuoteCache(hang)
+        waiter = asyncio.create_task(cache.get_many(["TCS"]))
+        await started.wait()
+        for t in list(cache._tasks): t.cancel()
+        assert await asyncio.wait_for(waiter, 1) == {}
+        assert not cache._inflight and not cache._tasks
+
+        cache.fetch_many = lambda syms: asyncio.sleep(0, {s: 1.0 for s in syms})
+        assert await asyncio.wait_for(cache.get_many(["TCS"]), 1) == {"TCS": 1.0}
+    asyncio.run(run())
+
+
+def test_concurrent_misses_share_one_fetch():
+    calls = []
+
+    async def fetch(syms):
+        calls.append(sorted(syms))
+        await asyncio.sleep(0.01)
+        return {s: 2.0 for s in syms}
+
+    async def run():
+        cache = bot.QuoteCache(fetch)
+        got = await asyncio.gather(*(cache.get_many(["TCS"]) for _ in range(5)))
+        assert got == [{"TCS": 2.0}] * 5 and calls == [["TCS"]]
+    asyncio.run(run())
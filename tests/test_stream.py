@@ -0,0 +1,62 @@
+import asyncio, json, sqlite3
+from contextlib import closing
+
+import pytest
+
+import telegram_stock_alert_bot as bot
+
+
+@pytest.fixture
+def replay(tmp_path):
+    def write(ticks):
+        path = tmp_path / "ticks.ndjson"
+        path.write_text("".join(json.dumps(t) + "\n" for t in ticks))
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def book(store, monkeypatch):
+    with closing(sqlite3.connect(store)) as db:
+        db.executemany("INSERT INTO price_alerts(user,symbol,op,threshold) VALUES(?,?,?,?)",
+                       [(1, "TCS", ">", 110.0), (2, "TCS", "<", 90.0), (3, "INFY", ">", 10.0)])
+        db.commit()
+    monkeypatch.setattr(bot, "BOOK", bot.AlertBook())
+    monkeypatch.setattr(bot, "QUOTE_CACHE", bot.QuoteCache(bot.QUOTE_SOURCE.prices))
+    monkeypatch.setattr(bot, "STREAM_FLUSH_SEC", 0.01)
+    asyncio.run(bot.BOOK.load())
+    return store
+
+
+async def play(stream, app, syms):
+    stream._on_tick = bot.stream_ticks(app)
+    stream.wanted = set(syms)
+    with pytest.raises(EOFError):
+        await stream._session()
+    await asyncio.sleep(0.1)   # let the tick batch flush
+
+
+def test_replay_ticks_fire_price_alerts(book, app, replay):
+    stream = bot.ReplayStream(replay([{"symbol": "TCS", "price": 100}, {"symbol": "tcs", "price": 111},
+                                      {"symbol": "WIPRO", "price": 5}]), speed=0)
+    asyncio.run(play(stream, app, {"TCS", "INFY"}))
+    with closing(sqlite3.connect(book)) as db:
+        sent = db.execute("SELECT user, text FROM outbox").fetchall()
+        armed = db.execute("SELECT user FROM price_alerts ORDER BY user").fetchall()
+    assert sent == [(1, "💲 Price alert: TCS is 111.00 > 110.0")]
+    assert armed == [(2,), (3,)]
+    assert bot.BOOK.symbols() == {"TCS", "INFY"}
+    assert stream.ticks == 2    # WIPRO was not subscribed
+
+
+def test_silent_stream_symbols_are_still_polled(book, app, replay, monkeypatch):
+    stream = bot.ReplayStream(replay([{"symbol": "TCS", "price": 100}]), speed=0)
+    asyncio.run(play(stream, app, {"TCS", "INFY"}))
+    assert stream.live(bot.QUOTE_TTL) == {"TCS"}
+
+    polled = []
+    monkeypatch.setattr(bot, "STREAM", stream)
+    monkeypatch.setattr(bot.QUOTA, "pick", lambda syms: polled.extend(syms) or [])
+    stream.connected = True
+    asyncio.run(bot.check_price_alerts(app))
+    assert polled == ["INFY"]